@@ -1,49 +1,83 @@
 from __future__ import annotations
 
+import hashlib
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import Dict
+from typing import Dict, Optional, Set, Tuple
 
 from . import data
 from .exceptions import AppError
 from .models import Account, LoginResult, Role
-from .security import generate_random_password, hash_password, verify_password
-
-_tokens: Dict[str, str] = {}
+from .security import generate_random_password, hash_password, needs_rehash, verify_password
 
 LOCKOUT_THRESHOLD = 5
 LOCKOUT_MINUTES = 15
+LOCKOUT_DURATION = timedelta(minutes=LOCKOUT_MINUTES)
+TOKEN_TTL = timedelta(hours=24)
+MAX_TOKENS = 10_000
+
+_tokens: OrderedDict[bytes, Tuple[str, datetime]] = OrderedDict()
+# 用户名 -> 该用户仍有效的 token 键，用于重置密码时一次性吊销
+_tokens_by_user: Dict[str, Set[bytes]] = {}
 
 
 def _now() -> datetime:
     return datetime.now(timezone.utc)
 
 
+def _token_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+
+def _forget_token(username: str, key: bytes) -> None:
+    keys = _tokens_by_user.get(username)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del _tokens_by_user[username]
+
+
 def authenticate(username: str, password: str) -> LoginResult:
     account = data.accounts.get(username)
     if not account:
         raise AppError(status_code=401, detail="账号或密码错误")
 
-    if account.locked_until and account.locked_until > _now():
+    now = _now()
+    if account.locked_until and account.locked_until > now:
         raise AppError(status_code=423, detail="账号或密码错误/账号锁定")
 
     if not verify_password(password, account.password_hash):
         account.failed_attempts += 1
         if account.failed_attempts >= LOCKOUT_THRESHOLD:
-            account.locked_until = _now() + timedelta(minutes=LOCKOUT_MINUTES)
+            account.locked_until = now + LOCKOUT_DURATION
         raise AppError(status_code=401, detail="账号或密码错误")
 
     account.failed_attempts = 0
     account.locked_until = None
+    if needs_rehash(account.password_hash):
+        account.password_hash = hash_password(password)
 
     token = generate_random_password(32)
-    _tokens[token] = account.username
+    key = _token_key(token)
+    _tokens[key] = (account.username, now)
+    _tokens.move_to_end(key)
+    _tokens_by_user.setdefault(account.username, set()).add(key)
+    while len(_tokens) > MAX_TOKENS:
+        old_key, (old_username, _) = _tokens.popitem(last=False)
+        _forget_token(old_username, old_key)
     return LoginResult(token=token, role=account.role, must_change_password=account.force_password_change)
 
 
 def get_account(token: str) -> Account:
-    username = _tokens.get(token)
-    if not username:
+    key = _token_key(token)
+    entry = _tokens.get(key)
+    if not entry:
         raise AppError(status_code=401, detail="未登录")
+    username, issued_at = entry
+    if _now() - issued_at >= TOKEN_TTL:
+        del _tokens[key]
+        _forget_token(username, key)
+        raise AppError(status_code=401, detail="登录已过期")
     account = data.accounts.get(username)
     if not account:
         raise AppError(status_code=401, detail="未登录")
@@ -52,7 +86,7 @@ def get_account(token: str) -> Account:
 
 def require_role(token: str, role: Role) -> Account:
     account = get_account(token)
-    if account.role != role:
+    if account.role is not role:
         raise AppError(status_code=403, detail="权限不足")
     return account
 
@@ -85,5 +119,17 @@ def reset_password(username: str) -> str:
     return new_password
 
 
+def revoke_tokens(username: str, keep: Optional[str] = None) -> None:
+    kept = _token_key(keep) if keep else None
+    for key in _tokens_by_user.pop(username, ()):
+        if key == kept:
+            _tokens_by_user[username] = {key}
+        else:
+            _tokens.pop(key, None)
+
+
 def logout(token: str) -> None:
-    _tokens.pop(token, None)
+    key = _token_key(token)
+    entry = _tokens.pop(key, None)
+    if entry is not None:
+        _forget_token(entry[0], key)
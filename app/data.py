@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import sys
+from collections import defaultdict, deque
 from datetime import date, datetime, timezone
-from typing import Dict, List, Tuple
+from typing import DefaultDict, Deque, Dict, Iterable, List, Set, Tuple
 
 from .models import (
     Account,
@@ -14,7 +16,7 @@ from .models import (
     Subject,
     Teacher,
 )
-from .security import hash_password
+from .security import seed_password_hash
 
 
 def _now() -> datetime:
@@ -30,6 +32,10 @@ students: Dict[str, Student] = {
     "S006": Student(student_no="S006", name="周八", class_name="Class 2", status="在读"),
 }
 
+students_by_class: DefaultDict[str, Set[str]] = defaultdict(set)
+for _student in students.values():
+    students_by_class[_student.class_name].add(_student.student_no)
+
 subjects: Dict[str, Subject] = {
     "CHN": Subject(subject_code="CHN", subject_name="语文"),
     "MTH": Subject(subject_code="MTH", subject_name="数学"),
@@ -53,7 +59,7 @@ exams: Dict[str, Exam] = {
     )
 }
 
-_initial_password_hash = hash_password("Pass@123")
+_initial_password_hash = seed_password_hash("Pass@123")
 accounts: Dict[str, Account] = {
     "principal": Account(username="principal", role=Role.PRINCIPAL, bind_id=None, password_hash=_initial_password_hash),
     "t_chn": Account(username="t_chn", role=Role.TEACHER, bind_id="T100", password_hash=_initial_password_hash),
@@ -88,23 +94,116 @@ _grade_seed = {
     ("EX2025M", "ENG", "S006"): 88,
 }
 
+subject_to_teacher: Dict[str, str] = {
+    subject_code: teacher.teacher_id
+    for teacher in teachers.values()
+    for subject_code in teacher.subjects
+}
+
 grades: Dict[Tuple[str, str, str], Grade] = {}
+grades_by_exam_subject: DefaultDict[Tuple[str, str], List[Grade]] = defaultdict(list)
+grades_by_student: DefaultDict[str, List[Grade]] = defaultdict(list)
+class_scores: Dict[Tuple[str, str, str], Tuple[float, int]] = {}
+# 按 (考试, 科目) 分列存放的分数，与 grades_by_exam_subject 中同一位置的 Grade 一一对应
+score_columns: DefaultDict[Tuple[str, str], List[float]] = defaultdict(list)
+score_slots: Dict[Tuple[str, str, str], int] = {}
+
+
+def _adjust_class_scores(grade: Grade, delta: float, count: int) -> None:
+    key = (grade.exam_id, grade.subject_code, students[grade.student_no].class_name)
+    total, existing = class_scores.get(key, (0, 0))
+    class_scores[key] = (total + delta, existing + count)
+
+
+# 成绩分数的版本号，新增成绩或修改分数时递增，供统计缓存判断是否失效
+grades_version = 0
+
+
+def add_grade(grade: Grade) -> None:
+    global grades_version
+    grade.exam_id = sys.intern(grade.exam_id)
+    grade.subject_code = sys.intern(grade.subject_code)
+    grade.student_no = sys.intern(grade.student_no)
+    key = (grade.exam_id, grade.subject_code, grade.student_no)
+    bucket_key = (grade.exam_id, grade.subject_code)
+    grades[key] = grade
+    bucket = grades_by_exam_subject[bucket_key]
+    score_slots[key] = len(bucket)
+    bucket.append(grade)
+    score_columns[bucket_key].append(grade.score)
+    grades_by_student[grade.student_no].append(grade)
+    _adjust_class_scores(grade, grade.score, 1)
+    grades_version += 1
+
+
+def set_grade_score(grade: Grade, score: float) -> None:
+    global grades_version
+    key = (grade.exam_id, grade.subject_code, grade.student_no)
+    _adjust_class_scores(grade, score - grade.score, 0)
+    score_columns[(grade.exam_id, grade.subject_code)][score_slots[key]] = score
+    grade.score = score
+    grades_version += 1
+
+
 for (exam_id, subject_code, student_no), score in _grade_seed.items():
-    teacher_id = next(
-        teacher.teacher_id
-        for teacher in teachers.values()
-        if subject_code in teacher.subjects
-    )
+    teacher_id = subject_to_teacher[subject_code]
     timestamp = _now()
-    grades[(exam_id, subject_code, student_no)] = Grade(
-        exam_id=exam_id,
-        subject_code=subject_code,
-        student_no=student_no,
-        score=score,
-        created_by=teacher_id,
-        created_at=timestamp,
-        updated_at=timestamp,
-        published=True,
+    add_grade(
+        Grade(
+            exam_id=exam_id,
+            subject_code=subject_code,
+            student_no=student_no,
+            score=score,
+            created_by=teacher_id,
+            created_at=timestamp,
+            updated_at=timestamp,
+            published=True,
+        )
     )
 
-audit_logs: List[AuditLogEntry] = []
+AUDIT_LOG_LIMIT = 100_000
+audit_logs: Deque[AuditLogEntry] = deque()
+# 按操作者、科目的索引只包含仍在 audit_logs 中的条目，上限由 AUDIT_LOG_LIMIT 统一约束
+audit_by_actor: DefaultDict[str, Deque[AuditLogEntry]] = defaultdict(deque)
+audit_by_subject: DefaultDict[str, Deque[AuditLogEntry]] = defaultdict(deque)
+
+
+AUDIT_FLUSH_THRESHOLD = 256
+pending_audit_logs: List[AuditLogEntry] = []
+
+
+def add_audit_logs(entries: Iterable[AuditLogEntry]) -> None:
+    pending_audit_logs.extend(entries)
+    if len(pending_audit_logs) >= AUDIT_FLUSH_THRESHOLD:
+        flush_audit_logs()
+
+
+def _drop_oldest(index: DefaultDict[str, Deque[AuditLogEntry]], key: str) -> None:
+    entries = index[key]
+    entries.popleft()
+    if not entries:
+        del index[key]
+
+
+def _evict_oldest_audit_log() -> None:
+    entry = audit_logs.popleft()
+    _drop_oldest(audit_by_actor, entry.actor)
+    subject_code = entry.details.get("subject_code")
+    if isinstance(subject_code, str):
+        _drop_oldest(audit_by_subject, subject_code)
+
+
+def flush_audit_logs() -> None:
+    if not pending_audit_logs:
+        return
+    by_actor = audit_by_actor
+    by_subject = audit_by_subject
+    for entry in pending_audit_logs:
+        while len(audit_logs) >= AUDIT_LOG_LIMIT:
+            _evict_oldest_audit_log()
+        audit_logs.append(entry)
+        by_actor[entry.actor].append(entry)
+        subject_code = entry.details.get("subject_code")
+        if isinstance(subject_code, str):
+            by_subject[subject_code].append(entry)
+    pending_audit_logs.clear()
@@ -51,7 +51,7 @@ class ExamStatus(str, Enum):
     DRAFT = "draft"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Exam:
     exam_id: str
     exam_name: str
@@ -59,9 +59,14 @@ class Exam:
     exam_date: date
     classes: List[str]
     status: ExamStatus
+    # 展示用日期字符串，创建时格式化一次
+    formatted_date: str = field(init=False, repr=False, compare=False)
 
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "formatted_date", self.exam_date.isoformat() if self.exam_date else "")
 
-@dataclass
+
+@dataclass(slots=True)
 class Grade:
     exam_id: str
     subject_code: str
@@ -81,7 +86,7 @@ class AuditAction(str, Enum):
     PASSWORD_RESET = "password_reset"
 
 
-@dataclass
+@dataclass(slots=True)
 class AuditLogEntry:
     timestamp: datetime
     actor: str
@@ -96,7 +101,7 @@ class LoginResult:
     must_change_password: bool
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class AggregatedStats:
     highest: float
     lowest: float
@@ -104,11 +109,12 @@ class AggregatedStats:
     pass_rate: float
 
 
-@dataclass
+@dataclass(slots=True)
 class StudentGradeView:
     exam_id: str
     exam_name: str
     exam_date: date
+    formatted_date: str
     subject_code: str
     subject_name: str
     score: float
@@ -121,7 +127,7 @@ class StudentGradeResponse:
     grades: List[StudentGradeView]
 
 
-@dataclass
+@dataclass(slots=True)
 class TeacherGradeView:
     student_no: str
     student_name: str
@@ -131,7 +137,7 @@ class TeacherGradeView:
     published: bool
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class OverviewEntry:
     exam_id: str
     exam_name: str
@@ -140,7 +146,7 @@ class OverviewEntry:
     stats: AggregatedStats
 
 
-@dataclass
+@dataclass(slots=True)
 class GradeDetailEntry:
     exam_id: str
     exam_name: str
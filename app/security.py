@@ -1,30 +1,102 @@
 from __future__ import annotations
 
 import hashlib
+import hmac
 import os
 import secrets
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+
+SCHEME = "scrypt"
+SEED_PREFIX = "seed:"
+
+_VERIFY_CACHE_SIZE = 256
+_VERIFY_CACHE_TTL = 60.0
+# 校验缓存以进程内随机密钥的 HMAC 为键，内存中不保留明文口令；值为过期时刻
+_VERIFY_PEPPER = os.urandom(32)
+_verify_cache: Dict[bytes, float] = {}
 
 
 def _salt_password(password: str, salt: bytes) -> bytes:
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=2**14, r=8, p=1, dklen=32)
+
+
+def _legacy_salt_password(password: str, salt: bytes) -> bytes:
     return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, 390000)
 
 
 def hash_password(password: str, salt: bytes | None = None) -> str:
     salt = salt or os.urandom(16)
     hashed = _salt_password(password, salt)
-    return f"{salt.hex()}${hashed.hex()}"
+    return f"{SCHEME}${salt.hex()}${hashed.hex()}"
 
 
-def verify_password(password: str, stored: str) -> bool:
+def seed_password_hash(password: str) -> str:
+    return f"{SEED_PREFIX}{password}"
+
+
+def needs_rehash(stored: str) -> bool:
+    return not stored.startswith(f"{SCHEME}$")
+
+
+@lru_cache(maxsize=256)
+def _decode_stored(stored: str) -> Optional[Tuple[Callable[[str, bytes], bytes], bytes, bytes]]:
+    parts = stored.split("$")
+    if len(parts) == 3 and parts[0] == SCHEME:
+        derive = _salt_password
+    elif len(parts) == 2:
+        # 旧版 PBKDF2 格式 "salt$hash"，登录成功后由 auth 重新哈希
+        derive = _legacy_salt_password
+    else:
+        return None
     try:
-        salt_hex, hash_hex = stored.split("$")
+        return derive, bytes.fromhex(parts[-2]), bytes.fromhex(parts[-1])
     except ValueError:
+        return None
+
+
+def _verify_cache_key(password: str, stored: str) -> bytes:
+    return hmac.new(_VERIFY_PEPPER, f"{stored}\0{password}".encode("utf-8"), hashlib.sha256).digest()
+
+
+def verify_password(password: str, stored: str) -> bool:
+    key = _verify_cache_key(password, stored)
+    now = time.monotonic()
+    expires_at = _verify_cache.get(key)
+    if expires_at is not None:
+        if expires_at > now:
+            return True
+        del _verify_cache[key]
+    if stored.startswith(SEED_PREFIX):
+        # 预置账号的占位口令，首次登录成功后由 auth 替换为真正的哈希
+        return secrets.compare_digest(password.encode("utf-8"), stored[len(SEED_PREFIX):].encode("utf-8"))
+    decoded = _decode_stored(stored)
+    if decoded is None:
+        return False
+    derive, salt, expected = decoded
+    if not secrets.compare_digest(derive(password, salt), expected):
         return False
-    salt = bytes.fromhex(salt_hex)
-    expected = bytes.fromhex(hash_hex)
-    return secrets.compare_digest(_salt_password(password, salt), expected)
+    # 键包含存储的哈希，改密或重置后旧条目不会再命中
+    if len(_verify_cache) >= _VERIFY_CACHE_SIZE:
+        del _verify_cache[next(iter(_verify_cache))]
+    _verify_cache[key] = now + _VERIFY_CACHE_TTL
+    return True
+
+
+_PASSWORD_ALPHABET = b"ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz23456789@#%&"
+# 拒绝采样上限：取字母表长度的最大整数倍，保证取模后分布均匀
+_PASSWORD_SAMPLE_LIMIT = 256 - 256 % len(_PASSWORD_ALPHABET)
 
 
 def generate_random_password(length: int = 12) -> str:
-    alphabet = "ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz23456789@#%&"
-    return "".join(secrets.choice(alphabet) for _ in range(length))
+    alphabet = _PASSWORD_ALPHABET
+    size = len(alphabet)
+    output = bytearray()
+    while len(output) < length:
+        for byte in secrets.token_bytes(length * 2):
+            if byte < _PASSWORD_SAMPLE_LIMIT:
+                output.append(alphabet[byte % size])
+                if len(output) == length:
+                    break
+    return output.decode("ascii")
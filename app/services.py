@@ -1,10 +1,14 @@
 from __future__ import annotations
 
 import csv
+import heapq
 import io
-from datetime import datetime, timezone
-from statistics import mean
-from typing import Iterable, List, Optional, Tuple
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from math import fsum
+from operator import attrgetter, itemgetter
+from typing import Collection, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 
 from . import data
 from .exceptions import AppError
@@ -24,6 +28,13 @@ from .models import (
 )
 
 PASSING_SCORE = 60
+_GRADE_ACTIONS = frozenset({AuditAction.GRADE_CREATED, AuditAction.GRADE_UPDATED, AuditAction.GRADE_PUBLISHED})
+IMPORT_COLUMNS = ("exam_id", "subject_code", "student_no", "score")
+_BY_SCORE = attrgetter("score")
+_BY_STUDENT_SUBJECT = attrgetter("student_no", "subject_code")
+
+# 每个线程复用一个导出缓冲区，多线程同时导出时互不干扰
+_export_local = threading.local()
 
 
 def _now() -> datetime:
@@ -48,7 +59,7 @@ def _require_student(student_no: str) -> None:
 
 
 def _teacher_for_account(account: Account) -> Tuple[str, List[str], List[str]]:
-    if account.role != Role.TEACHER:
+    if account.role is not Role.TEACHER:
         raise AppError(status_code=403, detail="权限不足")
     teacher = data.teachers.get(account.bind_id or "")
     if not teacher:
@@ -60,77 +71,111 @@ def _grade_key(exam_id: str, subject_code: str, student_no: str) -> Tuple[str, s
     return (exam_id, subject_code, student_no)
 
 
+@contextmanager
+def _export_buffer() -> Iterator[io.StringIO]:
+    output = getattr(_export_local, "buffer", None)
+    if output is None:
+        output = _export_local.buffer = io.StringIO()
+    try:
+        yield output
+    finally:
+        output.seek(0)
+        output.truncate(0)
+
+
+def _log_entry(action: AuditAction, actor: str, timestamp: datetime, **details: object) -> AuditLogEntry:
+    return AuditLogEntry(timestamp=timestamp, actor=actor, action=action, details=details)
+
+
 def _record_log(action: AuditAction, actor: str, **details: object) -> None:
-    data.audit_logs.append(
-        AuditLogEntry(timestamp=_now(), actor=actor, action=action, details=details)
-    )
+    data.add_audit_logs((_log_entry(action, actor, _now(), **details),))
 
 
 def _grades_for_student(student_no: str) -> List[Grade]:
-    return [grade for grade in data.grades.values() if grade.student_no == student_no]
+    return data.grades_by_student.get(student_no, [])
 
 
-def _visible_grades_for_teacher(account: Account) -> List[Grade]:
+def _visible_grades_for_teacher(
+    account: Account,
+    exam_id: Optional[str] = None,
+    class_name: Optional[str] = None,
+) -> Iterator[Grade]:
     _teacher_id, subjects, classes = _teacher_for_account(account)
-    student_ids = {
-        s.student_no
-        for s in data.students.values()
-        if s.class_name in classes
-    }
-    return [
+    allowed_classes = frozenset(classes)
+    if class_name:
+        allowed_classes = allowed_classes & {class_name}
+    if exam_id:
+        keys: Iterable[Tuple[str, str]] = [(exam_id, subject_code) for subject_code in subjects]
+    else:
+        owned = frozenset(subjects)
+        keys = [key for key in data.grades_by_exam_subject if key[1] in owned]
+    student_ids = set().union(*(data.students_by_class.get(cls, ()) for cls in allowed_classes))
+    buckets = data.grades_by_exam_subject
+    return (
         grade
-        for grade in data.grades.values()
-        if grade.subject_code in subjects and grade.student_no in student_ids
-    ]
+        for key in keys
+        for grade in buckets.get(key, ())
+        if grade.student_no in student_ids
+    )
+
+
+def _mean(total: float, count: int) -> float:
+    # 与 statistics.mean 一致：整数分数能整除时结果仍是整数
+    if type(total) is int and total % count == 0:
+        return total // count
+    return total / count
 
 
 def list_student_grades(account: Account, term: Optional[str] = None, exam_id: Optional[str] = None) -> StudentGradeResponse:
-    if account.role != Role.STUDENT:
+    if account.role is not Role.STUDENT:
         raise AppError(status_code=403, detail="权限不足")
 
     student = data.students.get(account.bind_id or "")
     if not student:
         raise AppError(status_code=404, detail="学生不存在")
 
-    relevant_grades = [grade for grade in _grades_for_student(student.student_no) if grade.published]
-    if term:
-        relevant_grades = [grade for grade in relevant_grades if data.exams[grade.exam_id].term == term]
-    if exam_id:
-        relevant_grades = [grade for grade in relevant_grades if grade.exam_id == exam_id]
-
-    views: List[StudentGradeView] = []
-    for grade in relevant_grades:
-        exam = data.exams.get(grade.exam_id)
-        if not exam:
+    exams = data.exams
+    subjects = data.subjects
+    class_scores = data.class_scores
+    class_name = student.class_name
+    keyed_views: List[Tuple[date, str, StudentGradeView]] = []
+    for grade in _grades_for_student(student.student_no):
+        if not grade.published or (exam_id and grade.exam_id != exam_id):
             continue
-        subject = data.subjects.get(grade.subject_code)
-        class_scores = [
-            g.score
-            for g in data.grades.values()
-            if g.exam_id == grade.exam_id
-            and g.subject_code == grade.subject_code
-            and data.students[g.student_no].class_name == student.class_name
-        ]
-        class_average = round(mean(class_scores), 2) if class_scores else grade.score
-        views.append(
-            StudentGradeView(
-                exam_id=grade.exam_id,
-                exam_name=exam.exam_name,
-                exam_date=exam.exam_date,
-                subject_code=grade.subject_code,
-                subject_name=subject.subject_name if subject else grade.subject_code,
-                score=grade.score,
-                class_average=class_average,
-            )
+        exam = exams.get(grade.exam_id)
+        if not exam or (term and exam.term != term):
+            continue
+        subject = subjects.get(grade.subject_code)
+        total, count = class_scores.get((grade.exam_id, grade.subject_code, class_name), (grade.score, 1))
+        view = StudentGradeView(
+            exam_id=grade.exam_id,
+            exam_name=exam.exam_name,
+            exam_date=exam.exam_date,
+            formatted_date=exam.formatted_date,
+            subject_code=grade.subject_code,
+            subject_name=subject.subject_name if subject else grade.subject_code,
+            score=grade.score,
+            class_average=round(_mean(total, count), 2),
         )
-
-    response = StudentGradeResponse(has_unread=student.has_unread_published_grades, grades=sorted(views, key=lambda g: (g.exam_date, g.subject_code)))
-    student.has_unread_published_grades = False
-    return response
-
-
-def teacher_update_grade(account: Account, exam_id: str, subject_code: str, student_no: str, score: float) -> Grade:
-    teacher_id, subjects, classes = _teacher_for_account(account)
+        keyed_views.append((exam.exam_date, grade.subject_code, view))
+
+    if len(keyed_views) > 1:
+        keyed_views.sort(key=itemgetter(0, 1))
+    views = [view for _exam_date, _subject_code, view in keyed_views]
+    has_unread = student.has_unread_published_grades
+    if has_unread:
+        student.has_unread_published_grades = False
+    return StudentGradeResponse(has_unread=has_unread, grades=views)
+
+
+def _check_grade_write(
+    exam_id: str,
+    subject_code: str,
+    student_no: str,
+    score: float,
+    subjects: Collection[str],
+    classes: Collection[str],
+) -> None:
     _require_exam(exam_id)
     _require_subject(subject_code)
     _require_student(student_no)
@@ -145,25 +190,34 @@ def teacher_update_grade(account: Account, exam_id: str, subject_code: str, stud
     if score < 0 or score > 100:
         raise AppError(status_code=400, detail="分数范围错误")
 
+
+def _write_grade(
+    teacher_id: str,
+    exam_id: str,
+    subject_code: str,
+    student_no: str,
+    score: float,
+    timestamp: datetime,
+) -> Tuple[Grade, AuditLogEntry]:
     key = _grade_key(exam_id, subject_code, student_no)
-    timestamp = _now()
     previous = data.grades.get(key)
     rounded_score = round(score, 1)
     if previous:
         old_score = previous.score
-        previous.score = rounded_score
+        data.set_grade_score(previous, rounded_score)
         previous.updated_at = timestamp
         previous.created_by = teacher_id
-        _record_log(
+        entry = _log_entry(
             AuditAction.GRADE_UPDATED,
             teacher_id,
+            timestamp,
             exam_id=exam_id,
             subject_code=subject_code,
             student_no=student_no,
             old_score=old_score,
             new_score=previous.score,
         )
-        return previous
+        return previous, entry
 
     grade = Grade(
         exam_id=exam_id,
@@ -175,69 +229,106 @@ def teacher_update_grade(account: Account, exam_id: str, subject_code: str, stud
         updated_at=timestamp,
         published=False,
     )
-    data.grades[key] = grade
-    _record_log(
+    data.add_grade(grade)
+    entry = _log_entry(
         AuditAction.GRADE_CREATED,
         teacher_id,
+        timestamp,
         exam_id=exam_id,
         subject_code=subject_code,
         student_no=student_no,
         score=grade.score,
     )
+    return grade, entry
+
+
+def teacher_update_grade(account: Account, exam_id: str, subject_code: str, student_no: str, score: float) -> Grade:
+    teacher_id, subjects, classes = _teacher_for_account(account)
+    _check_grade_write(exam_id, subject_code, student_no, score, subjects, classes)
+    grade, entry = _write_grade(teacher_id, exam_id, subject_code, student_no, score, _now())
+    data.add_audit_logs((entry,))
     return grade
 
 
 def teacher_import_grades(account: Account, csv_content: str) -> dict:
-    reader = csv.DictReader(io.StringIO(csv_content))
+    teacher_id, subjects, classes = _teacher_for_account(account)
+    subject_set = frozenset(subjects)
+    class_set = frozenset(classes)
+    reader = csv.reader(io.StringIO(csv_content))
+    positions = {name: index for index, name in enumerate(next(reader, []))}
+    missing = next((name for name in IMPORT_COLUMNS if name not in positions), None)
+    columns = None if missing else itemgetter(*(positions[name] for name in IMPORT_COLUMNS))
     errors: List[str] = []
+    pending_logs: List[AuditLogEntry] = []
     processed = 0
-    for idx, row in enumerate(reader, start=2):
+    timestamp = _now()
+    idx = 1
+    for row in reader:
+        if not row:
+            continue
+        idx += 1
+        if columns is None:
+            errors.append(f"第 {idx} 行格式错误: 缺少列 {missing}")
+            continue
         try:
-            exam_id = row["exam_id"].strip()
-            subject_code = row["subject_code"].strip()
-            student_no = row["student_no"].strip()
-            score = float(row["score"].strip())
+            exam_id, subject_code, student_no, score_text = columns(row)
+            exam_id = exam_id.strip()
+            subject_code = subject_code.strip()
+            student_no = student_no.strip()
+            score = float(score_text.strip())
         except Exception as exc:  # noqa: BLE001
             errors.append(f"第 {idx} 行格式错误: {exc}")
             continue
 
         try:
-            teacher_update_grade(account, exam_id, subject_code, student_no, score)
+            _check_grade_write(exam_id, subject_code, student_no, score, subject_set, class_set)
         except AppError as exc:
             errors.append(f"第 {idx} 行导入失败: {exc.detail}")
             continue
+        _grade, entry = _write_grade(teacher_id, exam_id, subject_code, student_no, score, timestamp)
+        pending_logs.append(entry)
         processed += 1
 
+    data.add_audit_logs(pending_logs)
     return {"processed": processed, "errors": errors}
 
 
+def _teacher_export_rows(grades: Iterable[Grade]) -> Iterator[Tuple[object, ...]]:
+    exams = data.exams
+    subjects = data.subjects
+    student_get = data.students.get
+    exam_names: Dict[str, str] = {}
+    subject_names: Dict[str, str] = {}
+    for grade in grades:
+        exam_id = grade.exam_id
+        exam_name = exam_names.get(exam_id)
+        if exam_name is None:
+            exam = exams.get(exam_id)
+            exam_name = exam_names[exam_id] = exam.exam_name if exam else exam_id
+        subject_code = grade.subject_code
+        subject_name = subject_names.get(subject_code)
+        if subject_name is None:
+            subject = subjects.get(subject_code)
+            subject_name = subject_names[subject_code] = subject.subject_name if subject else subject_code
+        student_no = grade.student_no
+        student = student_get(student_no)
+        if student:
+            yield exam_name, subject_name, student_no, student.name, student.class_name, grade.score
+        else:
+            yield exam_name, subject_name, student_no, student_no, "", grade.score
+
+
 def teacher_export_grades(account: Account, exam_id: Optional[str] = None, class_name: Optional[str] = None) -> str:
-    grades = _visible_grades_for_teacher(account)
-    if exam_id:
-        grades = [grade for grade in grades if grade.exam_id == exam_id]
-    if class_name:
-        grades = [grade for grade in grades if data.students[grade.student_no].class_name == class_name]
+    grades = _visible_grades_for_teacher(account, exam_id=exam_id, class_name=class_name)
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["exam", "subject", "student_no", "student_name", "class", "score"])
-    for grade in grades:
-        exam = data.exams.get(grade.exam_id)
-        subject = data.subjects.get(grade.subject_code)
-        student = data.students.get(grade.student_no)
-        writer.writerow(
-            [
-                exam.exam_name if exam else grade.exam_id,
-                subject.subject_name if subject else grade.subject_code,
-                grade.student_no,
-                student.name if student else grade.student_no,
-                student.class_name if student else "",
-                grade.score,
-            ]
-        )
+    with _export_buffer() as output:
+        writer = csv.writer(output)
+        writer.writerow(["exam", "subject", "student_no", "student_name", "class", "score"])
+        writer.writerows(_teacher_export_rows(grades))
+        content = output.getvalue()
 
     _record_log(AuditAction.EXPORT, account.bind_id or account.username, scope="teacher", exam_id=exam_id, class_name=class_name)
-    return output.getvalue()
+    return content
 
 
 def teacher_list_grades(
@@ -246,33 +337,30 @@ def teacher_list_grades(
     class_name: Optional[str] = None,
     sort_by: str = "student_no",
 ) -> List[TeacherGradeView]:
-    grades = _visible_grades_for_teacher(account)
-    if exam_id:
-        grades = [grade for grade in grades if grade.exam_id == exam_id]
-    if class_name:
-        grades = [grade for grade in grades if data.students[grade.student_no].class_name == class_name]
+    grades = _visible_grades_for_teacher(account, exam_id=exam_id, class_name=class_name)
 
-    views = [
-        TeacherGradeView(
-            student_no=grade.student_no,
-            student_name=data.students[grade.student_no].name,
-            class_name=data.students[grade.student_no].class_name,
-            subject_code=grade.subject_code,
-            score=grade.score,
-            published=grade.published,
+    students = data.students
+    views: List[TeacherGradeView] = []
+    for grade in grades:
+        student = students[grade.student_no]
+        views.append(
+            TeacherGradeView(
+                student_no=grade.student_no,
+                student_name=student.name,
+                class_name=student.class_name,
+                subject_code=grade.subject_code,
+                score=grade.score,
+                published=grade.published,
+            )
         )
-        for grade in grades
-    ]
 
-    reverse = False
     if sort_by == "score_desc":
-        key = lambda g: g.score
-        reverse = True
+        views.sort(key=_BY_SCORE, reverse=True)
     elif sort_by == "score_asc":
-        key = lambda g: g.score
+        views.sort(key=_BY_SCORE)
     else:
-        key = lambda g: (g.student_no, g.subject_code)
-    return sorted(views, key=key, reverse=reverse)
+        views.sort(key=_BY_STUDENT_SUBJECT)
+    return views
 
 
 def publish_grades(account: Account, exam_id: str, subject_code: str) -> int:
@@ -281,44 +369,64 @@ def publish_grades(account: Account, exam_id: str, subject_code: str) -> int:
         raise AppError(status_code=403, detail="无权发布该科目")
     _require_exam(exam_id)
 
+    allowed_students = set().union(*(data.students_by_class.get(cls, ()) for cls in classes))
+    notified: Set[str] = set()
     updated = 0
-    for grade in data.grades.values():
-        if grade.exam_id == exam_id and grade.subject_code == subject_code:
-            student = data.students.get(grade.student_no)
-            if student and student.class_name in classes:
-                if not grade.published:
-                    student.has_unread_published_grades = True
-                grade.published = True
-                updated += 1
+    for grade in data.grades_by_exam_subject.get((exam_id, subject_code), ()):
+        if grade.student_no not in allowed_students:
+            continue
+        if not grade.published:
+            grade.published = True
+            notified.add(grade.student_no)
+        updated += 1
+    students = data.students
+    for student_no in notified:
+        students[student_no].has_unread_published_grades = True
     if updated == 0:
         raise AppError(status_code=404, detail="未找到成绩记录")
     _record_log(AuditAction.GRADE_PUBLISHED, teacher_id, exam_id=exam_id, subject_code=subject_code, count=updated)
     return updated
 
 
-def _aggregate_scores(scores: Iterable[float]) -> Optional[AggregatedStats]:
-    scores = list(scores)
-    if not scores:
+def _aggregate_scores(scores: Sequence[float]) -> Optional[AggregatedStats]:
+    count = len(scores)
+    if not count:
         return None
-    highest = max(scores)
-    lowest = min(scores)
-    avg = round(mean(scores), 2)
-    passing = sum(1 for score in scores if score >= PASSING_SCORE)
-    pass_rate = round((passing / len(scores)) * 100, 2)
-    return AggregatedStats(highest=highest, lowest=lowest, average=avg, pass_rate=pass_rate)
+    total = sum(scores)
+    avg = round(_mean(total if type(total) is int else fsum(scores), count), 2)
+    passing = sum(score >= PASSING_SCORE for score in scores)
+    pass_rate = round((passing / count) * 100, 2)
+    return AggregatedStats(highest=max(scores), lowest=min(scores), average=avg, pass_rate=pass_rate)
+
+
+# 总览统计缓存：成绩版本或考试、科目名称变化后才重新计算
+_overview_cache: Dict[Optional[str], Tuple[Tuple[object, ...], List[OverviewEntry]]] = {}
 
 
 def principal_overview(exam_id: Optional[str] = None) -> List[OverviewEntry]:
+    version = (
+        data.grades_version,
+        tuple((exam.exam_id, exam.exam_name) for exam in data.exams.values()),
+        tuple((subject.subject_code, subject.subject_name) for subject in data.subjects.values()),
+    )
+    cached = _overview_cache.get(exam_id)
+    if cached is not None and cached[0] == version:
+        return list(cached[1])
+    entries = _compute_overview(exam_id)
+    _overview_cache[exam_id] = (version, entries)
+    return list(entries)
+
+
+def _compute_overview(exam_id: Optional[str]) -> List[OverviewEntry]:
     entries: List[OverviewEntry] = []
+    columns = data.score_columns
     exams = [data.exams[exam_id]] if exam_id else data.exams.values()
     for exam in exams:
         for subject in data.subjects.values():
-            scores = [
-                grade.score
-                for grade in data.grades.values()
-                if grade.exam_id == exam.exam_id and grade.subject_code == subject.subject_code
-            ]
-            stats = _aggregate_scores(scores)
+            column = columns.get((exam.exam_id, subject.subject_code))
+            if not column:
+                continue
+            stats = _aggregate_scores(column)
             if stats:
                 entries.append(
                     OverviewEntry(
@@ -368,12 +476,11 @@ def principal_grade_details(
 
 def principal_export_grades(**filters: Optional[str]) -> str:
     entries = principal_grade_details(**filters)
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["exam", "subject", "student_no", "student_name", "class", "score", "published"])
-    for entry in entries:
-        writer.writerow(
-            [
+    with _export_buffer() as output:
+        writer = csv.writer(output)
+        writer.writerow(["exam", "subject", "student_no", "student_name", "class", "score", "published"])
+        writer.writerows(
+            (
                 entry.exam_name,
                 entry.subject_name,
                 entry.student_no,
@@ -381,26 +488,33 @@ def principal_export_grades(**filters: Optional[str]) -> str:
                 entry.class_name,
                 entry.score,
                 "是" if entry.published else "否",
-            ]
+            )
+            for entry in entries
         )
+        content = output.getvalue()
     _record_log(AuditAction.EXPORT, "principal", scope="principal", filters=filters)
-    return output.getvalue()
+    return content
 
 
 def list_audit_logs(account: Account) -> List[AuditLogEntry]:
-    if account.role == Role.PRINCIPAL:
+    data.flush_audit_logs()
+    if account.role is Role.PRINCIPAL:
         return list(data.audit_logs)
-    if account.role == Role.TEACHER:
+    if account.role is Role.TEACHER:
         teacher_id, subjects, _ = _teacher_for_account(account)
-        return [
-            log
-            for log in data.audit_logs
-            if log.actor == teacher_id
-            or (
-                log.details.get("subject_code") in subjects
-                and log.action in {AuditAction.GRADE_CREATED, AuditAction.GRADE_UPDATED, AuditAction.GRADE_PUBLISHED}
-            )
-        ]
+        streams: List[Iterable[AuditLogEntry]] = [data.audit_by_actor.get(teacher_id, ())]
+        streams.extend(
+            (log for log in data.audit_by_subject.get(subject_code, ()) if log.action in _GRADE_ACTIONS)
+            for subject_code in subjects
+        )
+        # 同一条日志可能同时出现在操作者与科目两条索引中，按对象去重
+        seen: Set[int] = set()
+        logs: List[AuditLogEntry] = []
+        for log in heapq.merge(*streams, key=attrgetter("timestamp")):
+            if id(log) not in seen:
+                seen.add(id(log))
+                logs.append(log)
+        return logs
     raise AppError(status_code=403, detail="权限不足")
 
 
@@ -1,19 +1,38 @@
 from __future__ import annotations
 
+import hashlib
 import html
+import io
 import json
+import logging
+import os
 import secrets
+import sys
+import threading
+import time
 import urllib.parse
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
+from datetime import date
+from functools import lru_cache
 from http import HTTPStatus
-from http.cookies import SimpleCookie
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import Dict, List, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import MemoryHandler
+from operator import itemgetter
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple, Union
 
 from . import auth, data, services
 from .exceptions import AppError
 from .models import Account, Role
 
+try:  # 可选依赖：安装了 orjson 时用它格式化审计日志详情
+    import orjson
+except ImportError:  # pragma: no cover - 未安装时回退到标准库 json
+    orjson = None
+
+logger = logging.getLogger(__name__)
+LOG_BUFFER_CAPACITY = 1024
+
 ROLE_LABELS = {
     Role.STUDENT: "学生",
     Role.TEACHER: "老师",
@@ -21,92 +40,238 @@ ROLE_LABELS = {
 }
 
 
+_PUBLISHED_TAG = '<span class="tag green">已发布</span>'
+_UNPUBLISHED_TAG = '<span class="tag gray">未发布</span>'
+_TEACHER_SORT_OPTIONS = (
+    ("student_no", "按学号"),
+    ("score_desc", "分数从高到低"),
+    ("score_asc", "分数从低到高"),
+)
+
+
+@dataclass(frozen=True)
+class Redirect:
+    location: str
+
+
+# 每个会话最多保留的待显示提示条数，超出时丢弃最早的
+FLASH_LIMIT = 32
+
+
 @dataclass
 class SessionData:
     token: Optional[str] = None
-    flashes: List[Tuple[str, str]] = field(default_factory=list)
+    flashes: Deque[Tuple[str, str]] = field(default_factory=lambda: deque(maxlen=FLASH_LIMIT))
+    # 本次请求内已解析的账号，仅在 token 未变化时复用，每个请求开始时清空
+    account: Optional[Account] = None
+    account_token: Optional[str] = None
+
+
+# 会话表以会话 ID 的带密钥 BLAKE2b 摘要为键，内存中不保存 cookie 原文；
+# 按最近访问排序，超过容量或闲置超过 TTL 的会话会被淘汰。只在 _DISPATCH_LOCK 内访问
+_SESSION_KEY_SECRET = os.urandom(32)
+
+
+def _session_key(session_id: str) -> bytes:
+    return hashlib.blake2b(session_id.encode("utf-8"), key=_SESSION_KEY_SECRET, digest_size=16).digest()
+
+
+class SessionStore:
+    def __init__(self, maxsize: int = 100_000, ttl: float = 3600.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[bytes, Tuple[SessionData, float]] = OrderedDict()
+
+    def get(self, session_id: str) -> Optional[SessionData]:
+        key = _session_key(session_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        session, last_seen = entry
+        now = time.monotonic()
+        if now - last_seen > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries[key] = (session, now)
+        self._entries.move_to_end(key)
+        return session
+
+    def __setitem__(self, session_id: str, session: SessionData) -> None:
+        key = _session_key(session_id)
+        self._entries[key] = (session, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+SESSIONS = SessionStore()
+COOKIE_NAME = "SESSION_ID"
 
 
-SESSIONS: Dict[str, SessionData] = {}
-COOKIE_NAME = "SESSION_ID"
+def _exam_catalog() -> Tuple[Tuple[str, str, str, date], ...]:
+    return tuple((exam.exam_id, exam.exam_name, exam.term, exam.exam_date) for exam in data.exams.values())
+
+
+def _subject_catalog() -> Tuple[Tuple[str, str], ...]:
+    return tuple((subject.subject_code, subject.subject_name) for subject in data.subjects.values())
+
+
+@lru_cache(maxsize=1)
+def _exam_options(exams: Tuple[Tuple[str, str, str, date], ...]) -> str:
+    ordered = sorted(exams, key=itemgetter(3))
+    return "".join(
+        [f'<option value="{html.escape(exam_id)}">{html.escape(exam_name)}</option>' for exam_id, exam_name, _, _ in ordered]
+    )
+
+
+@lru_cache(maxsize=1)
+def _term_options(exams: Tuple[Tuple[str, str, str, date], ...]) -> str:
+    terms = sorted({term for _, _, term, _ in exams})
+    return "".join([f'<option value="{html.escape(term)}">{html.escape(term)}</option>' for term in terms])
+
+
+@lru_cache(maxsize=32)
+def _subject_options(subjects: Tuple[Tuple[str, str], ...], subject_codes: Optional[Tuple[str, ...]] = None) -> str:
+    if subject_codes is not None:
+        names = dict(subjects)
+        subjects = tuple((code, names[code]) for code in subject_codes if code in names)
+    return "".join(
+        [
+            f'<option value="{html.escape(subject_code)}">{html.escape(subject_name)}</option>'
+            for subject_code, subject_name in subjects
+        ]
+    )
+
+
+@lru_cache(maxsize=32)
+def _class_options(class_names: Tuple[str, ...]) -> str:
+    return "".join([f'<option value="{html.escape(cls)}">{html.escape(cls)}</option>' for cls in class_names])
+
+
+@lru_cache(maxsize=1)
+def _account_options(accounts: Tuple[Tuple[str, Role], ...]) -> str:
+    esc = html.escape
+    role_label = ROLE_LABELS.__getitem__
+    return "".join(
+        [
+            f'<option value="{esc(username)}">{esc(username)}（{role_label(role)}）</option>'
+            for username, role in sorted(accounts)
+        ]
+    )
+
+
+def _with_selected(options: str, value: Optional[str]) -> str:
+    if not value:
+        return options
+    attr = f'value="{html.escape(value)}"'
+    return options.replace(attr, f"{attr} selected", 1)
 
 
 def _get_account(session: SessionData) -> Optional[Account]:
-    if not session.token:
+    token = session.token
+    if not token:
         return None
+    if session.account is not None and session.account_token == token:
+        return session.account
     try:
-        return auth.get_account(session.token)
+        account = auth.get_account(token)
     except AppError:
         session.token = None
+        session.account = session.account_token = None
         return None
+    session.account = account
+    session.account_token = token
+    return account
+
+
+_PAGE_STYLE = """
+      body { font-family: Arial, sans-serif; background: #f6f7fb; margin:0; }
+      header { background: #324960; color:#fff; padding:16px 24px; }
+      main { padding: 24px; }
+      .container { max-width: 1080px; margin:0 auto; background:#fff; padding:24px; box-shadow:0 2px 6px rgba(0,0,0,0.08); border-radius:8px; }
+      nav a { color:#fff; margin-right:16px; text-decoration:none; }
+      table { width:100%; border-collapse:collapse; margin-top:16px; }
+      th, td { border:1px solid #dfe3eb; padding:8px 12px; text-align:left; }
+      th { background:#f0f3f8; }
+      .flash { padding:12px 16px; border-radius:6px; margin:16px 0; white-space:pre-line; }
+      .flash.error { background:#fdecea; color:#b3261e; }
+      .flash.success { background:#e5f5eb; color:#176537; }
+      .badge { display:inline-block; background:#d93025; color:#fff; padding:0 6px; margin-left:6px; border-radius:999px; font-size:12px; }
+      .tag { display:inline-block; padding:2px 8px; border-radius:999px; font-size:12px; }
+      .tag.green { background:#e5f5eb; color:#176537; }
+      .tag.gray { background:#e4e7ed; color:#434a59; }
+      button { background:#324960; color:#fff; border:none; padding:8px 16px; border-radius:4px; cursor:pointer; }
+      button.secondary { background:#61748f; }
+      button.danger { background:#b3261e; }
+      form.inline { display:inline-block; margin-right:12px; }
+      label { display:block; margin-top:8px; }
+      input[type="text"], input[type="password"], select, textarea { width:100%; padding:8px; border:1px solid #cdd5df; border-radius:4px; box-sizing:border-box; }
+"""
 
-
-def _render_page(title: str, account: Optional[Account], flashes: List[Tuple[str, str]], content: str) -> str:
-    nav_links = []
-    if account:
-        nav_links.append('<a href="/">首页</a>')
-        nav_links.append('<a href="/logout">退出登录</a>')
-    else:
-        nav_links.append('<a href="/login">登录</a>')
-    flash_html = "".join(
-        f'<div class="flash {html.escape(category)}">{html.escape(message)}</div>'
-        for category, message in flashes
-    )
-    role_badge = (
-        f"当前身份：{ROLE_LABELS.get(account.role, account.role.value)}（{html.escape(account.username)}）"
-        if account
-        else ""
-    )
-    return f"""<!doctype html>
-<html lang=\"zh-CN\">
+_PAGE_HEAD = b"""<!doctype html>
+<html lang="zh-CN">
   <head>
-    <meta charset=\"utf-8\" />
-    <title>{html.escape(title)}</title>
-    <style>
-      body {{ font-family: Arial, sans-serif; background: #f6f7fb; margin:0; }}
-      header {{ background: #324960; color:#fff; padding:16px 24px; }}
-      main {{ padding: 24px; }}
-      .container {{ max-width: 1080px; margin:0 auto; background:#fff; padding:24px; box-shadow:0 2px 6px rgba(0,0,0,0.08); border-radius:8px; }}
-      nav a {{ color:#fff; margin-right:16px; text-decoration:none; }}
-      table {{ width:100%; border-collapse:collapse; margin-top:16px; }}
-      th, td {{ border:1px solid #dfe3eb; padding:8px 12px; text-align:left; }}
-      th {{ background:#f0f3f8; }}
-      .flash {{ padding:12px 16px; border-radius:6px; margin:16px 0; }}
-      .flash.error {{ background:#fdecea; color:#b3261e; }}
-      .flash.success {{ background:#e5f5eb; color:#176537; }}
-      .badge {{ display:inline-block; background:#d93025; color:#fff; padding:0 6px; margin-left:6px; border-radius:999px; font-size:12px; }}
-      .tag {{ display:inline-block; padding:2px 8px; border-radius:999px; font-size:12px; }}
-      .tag.green {{ background:#e5f5eb; color:#176537; }}
-      .tag.gray {{ background:#e4e7ed; color:#434a59; }}
-      button {{ background:#324960; color:#fff; border:none; padding:8px 16px; border-radius:4px; cursor:pointer; }}
-      button.secondary {{ background:#61748f; }}
-      button.danger {{ background:#b3261e; }}
-      form.inline {{ display:inline-block; margin-right:12px; }}
-      label {{ display:block; margin-top:8px; }}
-      input[type=\"text\"], input[type=\"password\"], select, textarea {{ width:100%; padding:8px; border:1px solid #cdd5df; border-radius:4px; box-sizing:border-box; }}
-    </style>
+    <meta charset="utf-8" />
+    <title>"""
+_PAGE_HEADER_OPEN = (
+    """</title>
+    <style>"""
+    + _PAGE_STYLE
+    + """    </style>
   </head>
   <body>
     <header>
-      <div class=\"container\" style=\"background:transparent; box-shadow:none;\">
-        <div style=\"display:flex; justify-content:space-between; align-items:center;\">
+      <div class="container" style="background:transparent; box-shadow:none;">
+        <div style="display:flex; justify-content:space-between; align-items:center;">
           <div>
             <strong>学生成绩管理系统</strong>
-            <span style=\"margin-left:16px;\">{role_badge}</span>
+            <span style="margin-left:16px;">"""
+).encode("utf-8")
+_PAGE_NAV_OPEN = """</span>
           </div>
-          <nav>{' '.join(nav_links)}</nav>
+          <nav>"""
+_PAGE_MAIN_OPEN = """</nav>
         </div>
       </div>
     </header>
     <main>
-      <div class=\"container\">
-        {flash_html}
-        {content}
+      <div class="container">
+        """
+_PAGE_NAV_SIGNED_IN = (_PAGE_NAV_OPEN + '<a href="/">首页</a> <a href="/logout">退出登录</a>' + _PAGE_MAIN_OPEN).encode("utf-8")
+_PAGE_NAV_SIGNED_OUT = (_PAGE_NAV_OPEN + '<a href="/login">登录</a>' + _PAGE_MAIN_OPEN).encode("utf-8")
+_PAGE_CONTENT_SEP = b"""
+        """
+_PAGE_TAIL = b"""
       </div>
     </main>
   </body>
 </html>"""
 
+HtmlParts = List[Union[str, bytes]]
+
+
+def _render_page(title: str, account: Optional[Account], flashes: Iterable[Tuple[str, str]], content: HtmlParts) -> HtmlParts:
+    flash_html = "".join(
+        f'<div class="flash {html.escape(category)}">{html.escape(message)}</div>'
+        for category, message in flashes
+    )
+    role_badge = (
+        f"当前身份：{ROLE_LABELS[account.role]}（{html.escape(account.username)}）"
+        if account
+        else ""
+    )
+    return [
+        _PAGE_HEAD,
+        html.escape(title),
+        _PAGE_HEADER_OPEN,
+        role_badge,
+        _PAGE_NAV_SIGNED_IN if account else _PAGE_NAV_SIGNED_OUT,
+        flash_html,
+        _PAGE_CONTENT_SEP,
+        *content,
+        _PAGE_TAIL,
+    ]
+
 
 def _login_form(username: str = "") -> str:
     return f"""
@@ -132,16 +297,16 @@ def _login_form(username: str = "") -> str:
 """
 
 
-def render_login_page(session: SessionData, username: str = "") -> str:
+def render_login_page(session: SessionData, username: str = "") -> HtmlParts:
     account = _get_account(session)
-    flashes = session.flashes.copy()
-    session.flashes.clear()
-    return _render_page("登录 - 学生成绩管理系统", account, flashes, _login_form(username))
+    flashes, session.flashes = session.flashes, deque(maxlen=FLASH_LIMIT)
+    return _render_page("登录 - 学生成绩管理系统", account, flashes, [_login_form(username)])
 
 
-def render_student_page(session: SessionData, term: Optional[str] = None, exam_id: Optional[str] = None) -> str:
+def render_student_page(session: SessionData, term: Optional[str] = None, exam_id: Optional[str] = None) -> Union[HtmlParts, Redirect]:
+    esc = html.escape
     account = _get_account(session)
-    if not account or account.role != Role.STUDENT:
+    if not account or account.role is not Role.STUDENT:
         session.flashes.append(("error", "仅学生可访问该页面"))
         return render_redirect("/login")
 
@@ -151,30 +316,18 @@ def render_student_page(session: SessionData, term: Optional[str] = None, exam_i
         session.flashes.append(("error", exc.detail))
         return render_redirect("/")
 
-    exams = sorted(data.exams.values(), key=lambda e: e.exam_date)
-    terms = sorted({exam.term for exam in data.exams.values()})
-    selected_term = term or ""
-    selected_exam = exam_id or ""
-    rows = "".join(
-        """
-          <tr>
-            <td>{exam}</td>
-            <td>{date}</td>
-            <td>{subject}</td>
-            <td>{score:.1f}</td>
-            <td>{avg:.2f}</td>
-          </tr>
-        """.format(
-            exam=html.escape(item.exam_name),
-            date=item.exam_date.isoformat() if item.exam_date else "-",
-            subject=html.escape(item.subject_name),
-            score=item.score,
-            avg=item.class_average,
-        )
+    exams = _exam_catalog()
+    rows = [
+        f"<tr><td>{esc(item.exam_name, quote=False)}</td>"
+        f"<td>{item.formatted_date or '-'}</td>"
+        f"<td>{esc(item.subject_name, quote=False)}</td>"
+        f"<td>{item.score:.1f}</td><td>{item.class_average:.2f}</td></tr>"
         for item in result.grades
-    )
+    ]
+    term_options = _with_selected(_term_options(exams), term)
+    exam_options = _with_selected(_exam_options(exams), exam_id)
     badge = "<span class=\"badge\">新</span>" if result.has_unread else ""
-    filters = """
+    filters = f"""
 <form method=\"get\" action=\"/student\" style=\"display:flex; gap:16px; flex-wrap:wrap;\">
   <div>
     <label>学期</label>
@@ -194,25 +347,15 @@ def render_student_page(session: SessionData, term: Optional[str] = None, exam_i
     <button type=\"submit\">应用筛选</button>
   </div>
 </form>
-""".format(
-        term_options="".join(
-            f'<option value="{html.escape(item)}" {"selected" if item == selected_term else ""}>{html.escape(item)}</option>'
-            for item in terms
-        ),
-        exam_options="".join(
-            f'<option value="{exam.exam_id}" {"selected" if exam.exam_id == selected_exam else ""}>{html.escape(exam.exam_name)}</option>'
-            for exam in exams
-        ),
-    )
-    table = (
-        "<table>" +
-        "<thead><tr><th>考试</th><th>日期</th><th>科目</th><th>分数</th><th>班级均分</th></tr></thead><tbody>" +
-        (rows or "<tr><td colspan=5>当前筛选条件下暂无发布成绩。</td></tr>") +
-        "</tbody></table>"
-    )
-    content = f"<h1>我的成绩{badge}</h1>" + filters + table
-    flashes = session.flashes.copy()
-    session.flashes.clear()
+"""
+    content = [
+        f"<h1>我的成绩{badge}</h1>",
+        filters,
+        "<table><thead><tr><th>考试</th><th>日期</th><th>科目</th><th>分数</th><th>班级均分</th></tr></thead><tbody>",
+        *(rows or ["<tr><td colspan=5>当前筛选条件下暂无发布成绩。</td></tr>"]),
+        "</tbody></table>",
+    ]
+    flashes, session.flashes = session.flashes, deque(maxlen=FLASH_LIMIT)
     return _render_page("学生主页", account, flashes, content)
 
 
@@ -221,9 +364,10 @@ def render_teacher_page(
     exam_id: Optional[str] = None,
     class_name: Optional[str] = None,
     sort_by: str = "student_no",
-) -> str:
+) -> Union[HtmlParts, Redirect]:
+    esc = html.escape
     account = _get_account(session)
-    if not account or account.role != Role.TEACHER:
+    if not account or account.role is not Role.TEACHER:
         session.flashes.append(("error", "仅老师可访问该页面"))
         return render_redirect("/login")
 
@@ -238,29 +382,22 @@ def render_teacher_page(
         session.flashes.append(("error", exc.detail))
         return render_redirect("/")
 
-    exams = sorted(data.exams.values(), key=lambda e: e.exam_date)
-    subjects = [data.subjects.get(code) for code in teacher.subjects if code in data.subjects]
-    rows = "".join(
-        """
-          <tr>
-            <td>{student_no}</td>
-            <td>{student_name}</td>
-            <td>{class_name}</td>
-            <td>{subject}</td>
-            <td>{score:.1f}</td>
-            <td>{status}</td>
-          </tr>
-        """.format(
-            student_no=html.escape(item.student_no),
-            student_name=html.escape(item.student_name),
-            class_name=html.escape(item.class_name),
-            subject=html.escape(item.subject_code),
-            score=item.score,
-            status='<span class="tag green">已发布</span>' if item.published else '<span class="tag gray">未发布</span>',
-        )
+    exams = _exam_catalog()
+    rows = [
+        f"<tr><td>{esc(item.student_no, quote=False)}</td><td>{esc(item.student_name, quote=False)}</td>"
+        f"<td>{esc(item.class_name, quote=False)}</td><td>{esc(item.subject_code, quote=False)}</td>"
+        f"<td>{item.score:.1f}</td><td>{_PUBLISHED_TAG if item.published else _UNPUBLISHED_TAG}</td></tr>"
         for item in grades
+    ]
+    exam_options = _with_selected(_exam_options(exams), exam_id)
+    class_options = _with_selected(_class_options(tuple(teacher.classes)), class_name)
+    sort_options = "".join(
+        [
+            f'<option value="{value}" {"selected" if value == sort_by else ""}>{label}</option>'
+            for value, label in _TEACHER_SORT_OPTIONS
+        ]
     )
-    filters = """
+    filters = f"""
 <form method=\"get\" action=\"/teacher\" style=\"display:flex; gap:16px; flex-wrap:wrap;\">
   <div>
     <label>考试</label>
@@ -291,42 +428,16 @@ def render_teacher_page(
   <input type=\"hidden\" name=\"class_name\" value=\"{html.escape(class_name or '')}\" />
   <button type=\"submit\" class=\"secondary\">导出 CSV</button>
 </form>
-""".format(
-        exam_options="".join(
-            f'<option value="{exam.exam_id}" {"selected" if exam.exam_id == exam_id else ""}>{html.escape(exam.exam_name)}</option>'
-            for exam in exams
-        ),
-        class_options="".join(
-            f'<option value="{html.escape(cls)}" {"selected" if cls == class_name else ""}>{html.escape(cls)}</option>'
-            for cls in teacher.classes
-        ),
-        sort_options="".join(
-            f'<option value="{value}" {"selected" if value == sort_by else ""}>{label}</option>'
-            for value, label in (
-                ("student_no", "按学号"),
-                ("score_desc", "分数从高到低"),
-                ("score_asc", "分数从低到高"),
-            )
-        ),
-        exam_id=exam_id or "",
-        class_name=class_name or "",
-    )
-    table = (
-        "<table>" +
-        "<thead><tr><th>学号</th><th>姓名</th><th>班级</th><th>科目</th><th>分数</th><th>状态</th></tr></thead><tbody>" +
-        (rows or "<tr><td colspan=6>暂无成绩记录。</td></tr>") +
-        "</tbody></table>"
-    )
-    subjects_options = "".join(
-        f'<option value="{subject.subject_code}">{html.escape(subject.subject_name)}</option>'
-        for subject in subjects
-        if subject
-    )
-    content = (
-        "<h1>科目成绩列表</h1>" +
-        filters +
-        table +
-        """
+"""
+    subjects_options = _subject_options(_subject_catalog(), tuple(teacher.subjects)) or "<option value=\"\">暂无科目</option>"
+    exam_publish_options = _exam_options(exams)
+    content = [
+        "<h1>科目成绩列表</h1>",
+        filters,
+        "<table><thead><tr><th>学号</th><th>姓名</th><th>班级</th><th>科目</th><th>分数</th><th>状态</th></tr></thead><tbody>",
+        *(rows or ["<tr><td colspan=6>暂无成绩记录。</td></tr>"]),
+        "</tbody></table>",
+        f"""
 <section style=\"margin-top:32px;\">
   <h2>批量导入成绩</h2>
   <form method=\"post\" action=\"/teacher/import\" style=\"max-width:480px;\">
@@ -355,27 +466,27 @@ def render_teacher_page(
     </div>
   </form>
 </section>
-""".format(
-            exam_publish_options="".join(
-                f'<option value="{exam.exam_id}">{html.escape(exam.exam_name)}</option>'
-                for exam in exams
-            ),
-            subjects_options=subjects_options or "<option value=\"\">暂无科目</option>",
-        )
-    )
-    flashes = session.flashes.copy()
-    session.flashes.clear()
+""",
+    ]
+    flashes, session.flashes = session.flashes, deque(maxlen=FLASH_LIMIT)
     return _render_page("老师主页", account, flashes, content)
 
 
+def _format_details(details: dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(details, option=orjson.OPT_INDENT_2).decode("utf-8")
+    return json.dumps(details, ensure_ascii=False, indent=2)
+
+
 def render_principal_page(
     session: SessionData,
     exam_id: Optional[str] = None,
     subject_code: Optional[str] = None,
     class_name: Optional[str] = None,
-) -> str:
+) -> Union[HtmlParts, Redirect]:
+    esc = html.escape
     account = _get_account(session)
-    if not account or account.role != Role.PRINCIPAL:
+    if not account or account.role is not Role.PRINCIPAL:
         session.flashes.append(("error", "仅校长可访问该页面"))
         return render_redirect("/login")
 
@@ -387,70 +498,31 @@ def render_principal_page(
     )
     audit_logs = services.list_audit_logs(account)
 
-    exams = sorted(data.exams.values(), key=lambda e: e.exam_date)
-    subjects = list(data.subjects.values())
-    classes = sorted({student.class_name for student in data.students.values()})
-    accounts = sorted(data.accounts.values(), key=lambda a: a.username)
-
-    overview_rows = "".join(
-        """
-          <tr>
-            <td>{exam}</td>
-            <td>{subject}</td>
-            <td>{highest:.1f}</td>
-            <td>{lowest:.1f}</td>
-            <td>{average:.2f}</td>
-            <td>{pass_rate:.2f}%</td>
-          </tr>
-        """.format(
-            exam=html.escape(entry.exam_name),
-            subject=html.escape(entry.subject_name),
-            highest=entry.stats.highest,
-            lowest=entry.stats.lowest,
-            average=entry.stats.average,
-            pass_rate=entry.stats.pass_rate,
-        )
+    overview_rows = [
+        f"<tr><td>{esc(entry.exam_name, quote=False)}</td><td>{esc(entry.subject_name, quote=False)}</td>"
+        f"<td>{entry.stats.highest:.1f}</td><td>{entry.stats.lowest:.1f}</td>"
+        f"<td>{entry.stats.average:.2f}</td><td>{entry.stats.pass_rate:.2f}%</td></tr>"
         for entry in overview
-    )
-    detail_rows = "".join(
-        """
-          <tr>
-            <td>{exam}</td>
-            <td>{subject}</td>
-            <td>{student_no}</td>
-            <td>{student_name}</td>
-            <td>{class_name}</td>
-            <td>{score:.1f}</td>
-            <td>{status}</td>
-          </tr>
-        """.format(
-            exam=html.escape(item.exam_name),
-            subject=html.escape(item.subject_name),
-            student_no=html.escape(item.student_no),
-            student_name=html.escape(item.student_name),
-            class_name=html.escape(item.class_name),
-            score=item.score,
-            status="已发布" if item.published else "未发布",
-        )
+    ]
+    detail_rows = [
+        f"<tr><td>{esc(item.exam_name, quote=False)}</td><td>{esc(item.subject_name, quote=False)}</td>"
+        f"<td>{esc(item.student_no, quote=False)}</td><td>{esc(item.student_name, quote=False)}</td>"
+        f"<td>{esc(item.class_name, quote=False)}</td><td>{item.score:.1f}</td>"
+        f"<td>{'已发布' if item.published else '未发布'}</td></tr>"
         for item in details
-    )
-    log_rows = "".join(
-        """
-          <tr>
-            <td>{time}</td>
-            <td>{actor}</td>
-            <td>{action}</td>
-            <td><pre style=\"margin:0;\">{details}</pre></td>
-          </tr>
-        """.format(
-            time=html.escape(log.timestamp.astimezone().strftime("%Y-%m-%d %H:%M:%S")),
-            actor=html.escape(log.actor),
-            action=html.escape(log.action.value),
-            details=html.escape(json.dumps(log.details, ensure_ascii=False, indent=2)),
-        )
+    ]
+    format_details = _format_details
+    log_rows = [
+        f"<tr><td>{esc(log.timestamp.astimezone().strftime('%Y-%m-%d %H:%M:%S'), quote=False)}</td>"
+        f"<td>{esc(log.actor, quote=False)}</td><td>{esc(log.action.value, quote=False)}</td>"
+        f'<td><pre style="margin:0;">{esc(format_details(log.details), quote=False)}</pre></td></tr>'
         for log in audit_logs
-    )
-    filters_form = """
+    ]
+    exam_options = _with_selected(_exam_options(_exam_catalog()), exam_id)
+    subject_options = _with_selected(_subject_options(_subject_catalog()), subject_code)
+    class_names = tuple(sorted({student.class_name for student in data.students.values()}))
+    class_options = _with_selected(_class_options(class_names), class_name)
+    filters_form = f"""
 <form method=\"get\" action=\"/principal\" style=\"display:flex; gap:16px; flex-wrap:wrap;\">
   <div>
     <label>考试</label>
@@ -483,43 +555,29 @@ def render_principal_page(
   <input type=\"hidden\" name=\"class_name\" value=\"{html.escape(class_name or '')}\" />
   <button type=\"submit\" class=\"secondary\">导出 CSV</button>
 </form>
-""".format(
-        exam_options="".join(
-            f'<option value="{exam.exam_id}" {"selected" if exam.exam_id == exam_id else ""}>{html.escape(exam.exam_name)}</option>'
-            for exam in exams
-        ),
-        subject_options="".join(
-            f'<option value="{subject.subject_code}" {"selected" if subject.subject_code == subject_code else ""}>{html.escape(subject.subject_name)}</option>'
-            for subject in subjects
-        ),
-        class_options="".join(
-            f'<option value="{html.escape(cls)}" {"selected" if cls == class_name else ""}>{html.escape(cls)}</option>'
-            for cls in classes
-        ),
-        exam_id=exam_id or "",
-        subject_code=subject_code or "",
-        class_name=class_name or "",
-    )
-    accounts_options = "".join(
-        f'<option value="{html.escape(account.username)}">{html.escape(account.username)}（{ROLE_LABELS.get(account.role, account.role.value)}）</option>'
-        for account in accounts
-    )
-    content = (
-        "<h1>校长总览</h1>"
-        + """
+"""
+    accounts_options = _account_options(tuple((item.username, item.role) for item in data.accounts.values()))
+    content = [
+        """<h1>校长总览</h1>
 <section>
   <h2>成绩统计</h2>
   <table>
     <thead><tr><th>考试</th><th>科目</th><th>最高分</th><th>最低分</th><th>平均分</th><th>及格率</th></tr></thead>
-    <tbody>{overview_rows}</tbody>
+    <tbody>""",
+        *(overview_rows or ["<tr><td colspan=6>暂无数据</td></tr>"]),
+        """</tbody>
   </table>
 </section>
 <section style=\"margin-top:32px;\">
   <h2>成绩明细</h2>
-  {filters_form}
+  """,
+        filters_form,
+        """
   <table>
     <thead><tr><th>考试</th><th>科目</th><th>学号</th><th>姓名</th><th>班级</th><th>分数</th><th>是否发布</th></tr></thead>
-    <tbody>{detail_rows}</tbody>
+    <tbody>""",
+        *(detail_rows or ["<tr><td colspan=7>暂无数据</td></tr>"]),
+        f"""</tbody>
   </table>
 </section>
 <section style=\"margin-top:32px;\">
@@ -538,295 +596,367 @@ def render_principal_page(
   <h2>审计日志</h2>
   <table>
     <thead><tr><th>时间</th><th>操作者</th><th>动作</th><th>详情</th></tr></thead>
-    <tbody>{log_rows}</tbody>
+    <tbody>""",
+        *(log_rows or ["<tr><td colspan=4>暂无日志</td></tr>"]),
+        """</tbody>
   </table>
 </section>
-""".format(
-            overview_rows=overview_rows or "<tr><td colspan=6>暂无数据</td></tr>",
-            filters_form=filters_form,
-            detail_rows=detail_rows or "<tr><td colspan=7>暂无数据</td></tr>",
-            accounts_options=accounts_options,
-            log_rows=log_rows or "<tr><td colspan=4>暂无日志</td></tr>",
-        )
-    )
-    flashes = session.flashes.copy()
-    session.flashes.clear()
+""",
+    ]
+    flashes, session.flashes = session.flashes, deque(maxlen=FLASH_LIMIT)
     return _render_page("校长总览", account, flashes, content)
 
 
-def render_redirect(location: str) -> str:
-    return f"REDIRECT::{location}"
+def render_redirect(location: str) -> Redirect:
+    return Redirect(location)
+
+
+# 表单正文上限：单次导入不超过 5,000 行，1 MiB 足够
+MAX_FORM_BYTES = 1024 * 1024
 
 
 def _parse_form(handler: BaseHTTPRequestHandler) -> Dict[str, str]:
-    length = int(handler.headers.get("Content-Length", "0"))
-    raw = handler.rfile.read(length) if length else b""
-    data = urllib.parse.parse_qs(raw.decode("utf-8"))
-    return {key: values[0] for key, values in data.items()}
+    header = handler.headers.get("Content-Length")
+    if header is None:
+        return {}
+    try:
+        length = int(header)
+    except ValueError:
+        raise AppError(status_code=400, detail="Content-Length 无效") from None
+    if length < 0:
+        raise AppError(status_code=400, detail="Content-Length 无效")
+    if length > MAX_FORM_BYTES:
+        raise AppError(status_code=413, detail="请求正文过大")
+    if not length:
+        return {}
+    try:
+        text = handler.rfile.read(length).decode("utf-8")
+    except UnicodeDecodeError:
+        raise AppError(status_code=400, detail="表单编码无效") from None
+    return dict(urllib.parse.parse_qsl(text, keep_blank_values=True))
 
 
-def _apply_redirect(handler: BaseHTTPRequestHandler, location: str, session_id: str, new_session: bool) -> None:
+def _apply_redirect(handler: BaseHTTPRequestHandler, location: str, session_id: Optional[str], session: SessionData) -> None:
     handler.send_response(HTTPStatus.SEE_OTHER)
     handler.send_header("Location", location)
-    if new_session:
-        handler.send_header("Set-Cookie", f"{COOKIE_NAME}={session_id}; Path=/; HttpOnly")
+    _send_session_cookie(handler, session_id, session)
+    handler.send_header("Content-Length", "0")
     handler.end_headers()
 
 
-def _write_html(handler: BaseHTTPRequestHandler, content: str, session_id: str, new_session: bool) -> None:
+def _write_html(handler: BaseHTTPRequestHandler, parts: HtmlParts, session_id: Optional[str], session: SessionData) -> None:
     handler.send_response(HTTPStatus.OK)
     handler.send_header("Content-Type", "text/html; charset=utf-8")
-    if new_session:
-        handler.send_header("Set-Cookie", f"{COOKIE_NAME}={session_id}; Path=/; HttpOnly")
-    body = content.encode("utf-8")
+    _send_session_cookie(handler, session_id, session)
+    body = bytearray()
+    for part in parts:
+        body += part if type(part) is bytes else part.encode("utf-8")
     handler.send_header("Content-Length", str(len(body)))
     handler.end_headers()
     handler.wfile.write(body)
 
 
-def _write_csv(handler: BaseHTTPRequestHandler, content: str, filename: str, session_id: str, new_session: bool) -> None:
+def _write_csv(handler: BaseHTTPRequestHandler, content: str, filename: str, session_id: Optional[str], session: SessionData) -> None:
     handler.send_response(HTTPStatus.OK)
     handler.send_header("Content-Type", "text/csv; charset=utf-8")
     handler.send_header("Content-Disposition", f"attachment; filename={filename}")
-    if new_session:
-        handler.send_header("Set-Cookie", f"{COOKIE_NAME}={session_id}; Path=/; HttpOnly")
+    _send_session_cookie(handler, session_id, session)
     body = content.encode("utf-8")
     handler.send_header("Content-Length", str(len(body)))
     handler.end_headers()
     handler.wfile.write(body)
 
 
-def _load_session(handler: BaseHTTPRequestHandler) -> Tuple[str, SessionData, bool]:
-    cookie_header = handler.headers.get("Cookie", "")
-    cookie = SimpleCookie()
-    try:
-        cookie.load(cookie_header)
-    except Exception:  # noqa: BLE001
-        cookie = SimpleCookie()
-    if COOKIE_NAME in cookie:
-        session_id = cookie[COOKIE_NAME].value
-        session = SESSIONS.setdefault(session_id, SessionData())
-        return session_id, session, False
-    session_id = secrets.token_hex(16)
-    session = SessionData()
+def _session_id_from_cookie(cookie_header: str) -> Optional[str]:
+    for part in cookie_header.split(";"):
+        name, eq, value = part.partition("=")
+        if eq and name.strip() == COOKIE_NAME:
+            return value.strip() or None
+    return None
+
+
+# 没有有效 cookie 的请求先使用临时会话，只有登录成功或留下提示信息时才分配会话 ID 并写入会话表
+def _load_session(handler: BaseHTTPRequestHandler) -> Tuple[Optional[str], SessionData]:
+    session_id = _session_id_from_cookie(handler.headers.get("Cookie", ""))
+    if session_id:
+        session = SESSIONS.get(session_id)
+        if session is not None:
+            session.account = session.account_token = None
+            return session_id, session
+    return None, SessionData()
+
+
+def _send_session_cookie(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData) -> None:
+    if session_id is not None or not (session.token or session.flashes):
+        return
+    session_id = secrets.token_urlsafe(18)
     SESSIONS[session_id] = session
-    return session_id, session, True
+    handler.send_header("Set-Cookie", f"{COOKIE_NAME}={session_id}; Path=/; HttpOnly")
 
 
-class GradeRequestHandler(BaseHTTPRequestHandler):
-    def do_GET(self) -> None:  # noqa: N802
-        session_id, session, new_session = _load_session(self)
-        parsed = urllib.parse.urlparse(self.path)
-        query = urllib.parse.parse_qs(parsed.query)
-        path = parsed.path
-
-        if path == "/":
-            account = _get_account(session)
-            if not account:
-                _apply_redirect(self, "/login", session_id, new_session)
-                return
-            if account.role == Role.STUDENT:
-                _apply_redirect(self, "/student", session_id, new_session)
-                return
-            if account.role == Role.TEACHER:
-                _apply_redirect(self, "/teacher", session_id, new_session)
-                return
-            _apply_redirect(self, "/principal", session_id, new_session)
-            return
+# 会话与数据是进程内共享结构，路由处理在此锁内串行执行；读取请求与发送响应都在锁外进行
+_DISPATCH_LOCK = threading.Lock()
 
-        if path == "/login":
-            html_content = render_login_page(session)
-            _write_html(self, html_content, session_id, new_session)
-            return
 
-        if path == "/logout":
-            if session.token:
-                auth.logout(session.token)
-            session.token = None
-            session.flashes.append(("success", "您已退出登录"))
-            _apply_redirect(self, "/login", session_id, new_session)
-            return
+def _handle_root(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, query: Dict[str, str]) -> None:
+    account = _get_account(session)
+    if not account:
+        _apply_redirect(handler, "/login", session_id, session)
+        return
+    if account.role is Role.STUDENT:
+        _apply_redirect(handler, "/student", session_id, session)
+        return
+    if account.role is Role.TEACHER:
+        _apply_redirect(handler, "/teacher", session_id, session)
+        return
+    _apply_redirect(handler, "/principal", session_id, session)
 
-        if path == "/student":
-            term = query.get("term", [""])[0] or None
-            exam_id = query.get("exam_id", [""])[0] or None
-            page = render_student_page(session, term=term, exam_id=exam_id)
-            if page.startswith("REDIRECT::"):
-                _apply_redirect(self, page.split("::", 1)[1], session_id, new_session)
-            else:
-                _write_html(self, page, session_id, new_session)
-            return
 
-        if path == "/teacher":
-            exam_id = query.get("exam_id", [""])[0] or None
-            class_name = query.get("class_name", [""])[0] or None
-            sort_by = query.get("sort_by", ["student_no"])[0]
-            page = render_teacher_page(session, exam_id=exam_id, class_name=class_name, sort_by=sort_by)
-            if page.startswith("REDIRECT::"):
-                _apply_redirect(self, page.split("::", 1)[1], session_id, new_session)
-            else:
-                _write_html(self, page, session_id, new_session)
-            return
+def _handle_login_page(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, query: Dict[str, str]) -> None:
+    html_content = render_login_page(session)
+    _write_html(handler, html_content, session_id, session)
 
-        if path == "/teacher/export":
-            account = _get_account(session)
-            if not account or account.role != Role.TEACHER:
-                session.flashes.append(("error", "无权执行该操作"))
-                _apply_redirect(self, "/login", session_id, new_session)
-                return
-            exam_id = query.get("exam_id", [""])[0] or None
-            class_name = query.get("class_name", [""])[0] or None
-            try:
-                csv_content = services.teacher_export_grades(account, exam_id=exam_id, class_name=class_name)
-            except AppError as exc:
-                session.flashes.append(("error", exc.detail))
-                _apply_redirect(self, "/teacher", session_id, new_session)
-                return
-            _write_csv(self, csv_content, "teacher_grades.csv", session_id, new_session)
-            return
 
-        if path == "/principal":
-            exam_id = query.get("exam_id", [""])[0] or None
-            subject_code = query.get("subject_code", [""])[0] or None
-            class_name = query.get("class_name", [""])[0] or None
-            page = render_principal_page(session, exam_id=exam_id, subject_code=subject_code, class_name=class_name)
-            if page.startswith("REDIRECT::"):
-                _apply_redirect(self, page.split("::", 1)[1], session_id, new_session)
-            else:
-                _write_html(self, page, session_id, new_session)
-            return
+def _handle_logout(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, query: Dict[str, str]) -> None:
+    if session.token:
+        auth.logout(session.token)
+    session.token = None
+    session.flashes.append(("success", "您已退出登录"))
+    _apply_redirect(handler, "/login", session_id, session)
 
-        if path == "/principal/export":
-            account = _get_account(session)
-            if not account or account.role != Role.PRINCIPAL:
-                session.flashes.append(("error", "无权执行该操作"))
-                _apply_redirect(self, "/login", session_id, new_session)
-                return
-            filters = {
-                "exam_id": query.get("exam_id", [""])[0] or None,
-                "subject_code": query.get("subject_code", [""])[0] or None,
-                "class_name": query.get("class_name", [""])[0] or None,
-            }
-            try:
-                csv_content = services.principal_export_grades(**filters)
-            except AppError as exc:
-                session.flashes.append(("error", exc.detail))
-                _apply_redirect(self, "/principal", session_id, new_session)
-                return
-            _write_csv(self, csv_content, "all_grades.csv", session_id, new_session)
-            return
 
-        self.send_error(HTTPStatus.NOT_FOUND)
+def _handle_student(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, query: Dict[str, str]) -> None:
+    term = query.get("term") or None
+    exam_id = query.get("exam_id") or None
+    page = render_student_page(session, term=term, exam_id=exam_id)
+    if isinstance(page, Redirect):
+        _apply_redirect(handler, page.location, session_id, session)
+    else:
+        _write_html(handler, page, session_id, session)
 
-    def do_POST(self) -> None:  # noqa: N802
-        session_id, session, new_session = _load_session(self)
-        path = urllib.parse.urlparse(self.path).path
-
-        if path == "/login":
-            form = _parse_form(self)
-            username = form.get("username", "").strip()
-            password = form.get("password", "")
-            if not username or not password:
-                session.flashes.append(("error", "请输入用户名和密码"))
-                html_content = render_login_page(session, username=username)
-                _write_html(self, html_content, session_id, new_session)
-                return
-            try:
-                result = auth.authenticate(username, password)
-            except AppError as exc:
-                session.flashes.append(("error", exc.detail))
-                html_content = render_login_page(session, username=username)
-                _write_html(self, html_content, session_id, new_session)
-                return
-            session.token = result.token
-            if result.must_change_password:
-                session.flashes.append(("success", "首次登录，请尽快修改初始密码"))
-            _apply_redirect(self, "/", session_id, new_session)
-            return
 
-        if path == "/teacher/import":
-            account = _get_account(session)
-            if not account or account.role != Role.TEACHER:
-                session.flashes.append(("error", "无权执行该操作"))
-                _apply_redirect(self, "/login", session_id, new_session)
-                return
-            form = _parse_form(self)
-            csv_text = form.get("csv_text", "").strip()
-            if not csv_text:
-                session.flashes.append(("error", "请粘贴 CSV 内容"))
-                _apply_redirect(self, "/teacher", session_id, new_session)
-                return
-            try:
-                result = services.teacher_import_grades(account, csv_text)
-            except AppError as exc:
-                session.flashes.append(("error", exc.detail))
-            else:
-                processed = result.get("processed", 0)
-                errors = result.get("errors", [])
-                if processed:
-                    session.flashes.append(("success", f"成功导入 {processed} 条成绩记录"))
-                for message in errors:
-                    session.flashes.append(("error", message))
-            _apply_redirect(self, "/teacher", session_id, new_session)
-            return
+def _handle_teacher(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, query: Dict[str, str]) -> None:
+    exam_id = query.get("exam_id") or None
+    class_name = query.get("class_name") or None
+    sort_by = query.get("sort_by") or "student_no"
+    page = render_teacher_page(session, exam_id=exam_id, class_name=class_name, sort_by=sort_by)
+    if isinstance(page, Redirect):
+        _apply_redirect(handler, page.location, session_id, session)
+    else:
+        _write_html(handler, page, session_id, session)
 
-        if path == "/teacher/publish":
-            account = _get_account(session)
-            if not account or account.role != Role.TEACHER:
-                session.flashes.append(("error", "无权执行该操作"))
-                _apply_redirect(self, "/login", session_id, new_session)
-                return
-            form = _parse_form(self)
-            exam_id = form.get("exam_id", "").strip()
-            subject_code = form.get("subject_code", "").strip()
-            if not exam_id or not subject_code:
-                session.flashes.append(("error", "请选择考试与科目"))
-                _apply_redirect(self, "/teacher", session_id, new_session)
-                return
-            try:
-                count = services.publish_grades(account, exam_id, subject_code)
-            except AppError as exc:
-                session.flashes.append(("error", exc.detail))
-            else:
-                session.flashes.append(("success", f"已发布 {count} 条成绩"))
-            _apply_redirect(self, "/teacher", session_id, new_session)
-            return
 
-        if path == "/principal/reset":
-            account = _get_account(session)
-            if not account or account.role != Role.PRINCIPAL:
-                session.flashes.append(("error", "无权执行该操作"))
-                _apply_redirect(self, "/login", session_id, new_session)
-                return
-            form = _parse_form(self)
-            username = form.get("username", "").strip()
-            if not username:
-                session.flashes.append(("error", "请选择账号"))
-                _apply_redirect(self, "/principal", session_id, new_session)
-                return
+def _handle_teacher_export(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, query: Dict[str, str]) -> None:
+    account = _get_account(session)
+    if not account or account.role is not Role.TEACHER:
+        session.flashes.append(("error", "无权执行该操作"))
+        _apply_redirect(handler, "/login", session_id, session)
+        return
+    exam_id = query.get("exam_id") or None
+    class_name = query.get("class_name") or None
+    try:
+        csv_content = services.teacher_export_grades(account, exam_id=exam_id, class_name=class_name)
+    except AppError as exc:
+        session.flashes.append(("error", exc.detail))
+        _apply_redirect(handler, "/teacher", session_id, session)
+        return
+    _write_csv(handler, csv_content, "teacher_grades.csv", session_id, session)
+
+
+def _handle_principal(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, query: Dict[str, str]) -> None:
+    exam_id = query.get("exam_id") or None
+    subject_code = query.get("subject_code") or None
+    class_name = query.get("class_name") or None
+    page = render_principal_page(session, exam_id=exam_id, subject_code=subject_code, class_name=class_name)
+    if isinstance(page, Redirect):
+        _apply_redirect(handler, page.location, session_id, session)
+    else:
+        _write_html(handler, page, session_id, session)
+
+
+def _handle_principal_export(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, query: Dict[str, str]) -> None:
+    account = _get_account(session)
+    if not account or account.role is not Role.PRINCIPAL:
+        session.flashes.append(("error", "无权执行该操作"))
+        _apply_redirect(handler, "/login", session_id, session)
+        return
+    filters = {
+        "exam_id": query.get("exam_id") or None,
+        "subject_code": query.get("subject_code") or None,
+        "class_name": query.get("class_name") or None,
+    }
+    try:
+        csv_content = services.principal_export_grades(**filters)
+    except AppError as exc:
+        session.flashes.append(("error", exc.detail))
+        _apply_redirect(handler, "/principal", session_id, session)
+        return
+    _write_csv(handler, csv_content, "all_grades.csv", session_id, session)
+
+
+def _handle_login(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, form: Dict[str, str]) -> None:
+    username = form.get("username", "").strip()
+    password = form.get("password", "")
+    if not username or not password:
+        session.flashes.append(("error", "请输入用户名和密码"))
+        html_content = render_login_page(session, username=username)
+        _write_html(handler, html_content, session_id, session)
+        return
+    try:
+        result = auth.authenticate(username, password)
+    except AppError as exc:
+        session.flashes.append(("error", exc.detail))
+        html_content = render_login_page(session, username=username)
+        _write_html(handler, html_content, session_id, session)
+        return
+    session.token = result.token
+    if result.must_change_password:
+        session.flashes.append(("success", "首次登录，请尽快修改初始密码"))
+    _apply_redirect(handler, "/", session_id, session)
+
+
+def _handle_teacher_import(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, form: Dict[str, str]) -> None:
+    account = _get_account(session)
+    if not account or account.role is not Role.TEACHER:
+        session.flashes.append(("error", "无权执行该操作"))
+        _apply_redirect(handler, "/login", session_id, session)
+        return
+    csv_text = form.get("csv_text", "").strip()
+    if not csv_text:
+        session.flashes.append(("error", "请粘贴 CSV 内容"))
+        _apply_redirect(handler, "/teacher", session_id, session)
+        return
+    try:
+        result = services.teacher_import_grades(account, csv_text)
+    except AppError as exc:
+        session.flashes.append(("error", exc.detail))
+    else:
+        processed = result.get("processed", 0)
+        errors = result.get("errors", [])
+        if processed:
+            session.flashes.append(("success", f"成功导入 {processed} 条成绩记录"))
+        if errors:
+            session.flashes.append(("error", "\n".join(errors)))
+    _apply_redirect(handler, "/teacher", session_id, session)
+
+
+def _handle_teacher_publish(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, form: Dict[str, str]) -> None:
+    account = _get_account(session)
+    if not account or account.role is not Role.TEACHER:
+        session.flashes.append(("error", "无权执行该操作"))
+        _apply_redirect(handler, "/login", session_id, session)
+        return
+    exam_id = form.get("exam_id", "").strip()
+    subject_code = form.get("subject_code", "").strip()
+    if not exam_id or not subject_code:
+        session.flashes.append(("error", "请选择考试与科目"))
+        _apply_redirect(handler, "/teacher", session_id, session)
+        return
+    try:
+        count = services.publish_grades(account, exam_id, subject_code)
+    except AppError as exc:
+        session.flashes.append(("error", exc.detail))
+    else:
+        session.flashes.append(("success", f"已发布 {count} 条成绩"))
+    _apply_redirect(handler, "/teacher", session_id, session)
+
+
+def _handle_principal_reset(handler: BaseHTTPRequestHandler, session_id: Optional[str], session: SessionData, form: Dict[str, str]) -> None:
+    account = _get_account(session)
+    if not account or account.role is not Role.PRINCIPAL:
+        session.flashes.append(("error", "无权执行该操作"))
+        _apply_redirect(handler, "/login", session_id, session)
+        return
+    username = form.get("username", "").strip()
+    if not username:
+        session.flashes.append(("error", "请选择账号"))
+        _apply_redirect(handler, "/principal", session_id, session)
+        return
+    try:
+        new_password = auth.reset_password(username)
+        services.mark_password_reset(account.username, username)
+        auth.revoke_tokens(username, keep=session.token)
+    except AppError as exc:
+        session.flashes.append(("error", exc.detail))
+    else:
+        session.flashes.append(("success", f"账号 {username} 新密码：{new_password}"))
+    _apply_redirect(handler, "/principal", session_id, session)
+
+
+RouteHandler = Callable[[BaseHTTPRequestHandler, Optional[str], SessionData, Dict[str, str]], None]
+
+
+class GradeRequestHandler(BaseHTTPRequestHandler):
+    # 保持连接要求每个响应都带 Content-Length
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    _ROUTES: Dict[Tuple[str, str], RouteHandler] = {
+        ("GET", "/"): _handle_root,
+        ("GET", "/login"): _handle_login_page,
+        ("GET", "/logout"): _handle_logout,
+        ("GET", "/student"): _handle_student,
+        ("GET", "/teacher"): _handle_teacher,
+        ("GET", "/teacher/export"): _handle_teacher_export,
+        ("GET", "/principal"): _handle_principal,
+        ("GET", "/principal/export"): _handle_principal_export,
+        ("POST", "/login"): _handle_login,
+        ("POST", "/teacher/import"): _handle_teacher_import,
+        ("POST", "/teacher/publish"): _handle_teacher_publish,
+        ("POST", "/principal/reset"): _handle_principal_reset,
+    }
+
+    def do_GET(self) -> None:  # noqa: N802
+        self._dispatch()
+
+    def do_POST(self) -> None:  # noqa: N802
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        parsed = urllib.parse.urlsplit(self.path)
+        # POST 正文必须在任何提前返回之前读完，否则保持连接时残留的正文会被当作下一个请求解析
+        if self.command == "POST":
             try:
-                new_password = auth.reset_password(username)
-                services.mark_password_reset(account.username, username)
+                params = _parse_form(self)
             except AppError as exc:
-                session.flashes.append(("error", exc.detail))
-            else:
-                session.flashes.append(("success", f"账号 {username} 新密码：{new_password}"))
-            _apply_redirect(self, "/principal", session_id, new_session)
+                self.send_error(exc.status_code)
+                return
+        else:
+            params = dict(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)) if parsed.query else {}
+        route = self._ROUTES.get((self.command, parsed.path))
+        if route is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
             return
-
-        self.send_error(HTTPStatus.NOT_FOUND)
+        wfile, self.wfile = self.wfile, io.BytesIO()
+        try:
+            with _DISPATCH_LOCK:
+                session_id, session = _load_session(self)
+                route(self, session_id, session, params)
+        finally:
+            response, self.wfile = self.wfile.getvalue(), wfile
+        wfile.write(response)
 
     def log_message(self, format: str, *args: object) -> None:  # noqa: A003
-        return
+        logger.debug("%s - " + format, self.address_string(), *args)
 
 
-def run(host: str = "127.0.0.1", port: int = 8000) -> None:
-    with HTTPServer((host, port), GradeRequestHandler) as httpd:
-        print(f"服务器已启动：http://{host}:{port}")
-        try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:  # pragma: no cover - 手动停止
-            print("\n服务器已停止")
+def run(host: str = "127.0.0.1", port: int = 8000, log_level: int = logging.INFO) -> None:
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(logging.Formatter("%(message)s"))
+    buffered = MemoryHandler(LOG_BUFFER_CAPACITY, flushLevel=logging.ERROR, target=stream)
+    logger.addHandler(buffered)
+    logger.setLevel(log_level)
+    try:
+        with ThreadingHTTPServer((host, port), GradeRequestHandler) as httpd:
+            logger.info("服务器已启动：http://%s:%s", host, port)
+            buffered.flush()
+            try:
+                httpd.serve_forever()
+            except KeyboardInterrupt:  # pragma: no cover - 手动停止
+                logger.info("服务器已停止")
+    finally:
+        logger.removeHandler(buffered)
+        buffered.close()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,16 @@
 from __future__ import annotations
 
-import importlib
+import copy
+import dataclasses
+import http.client
+import socket
 import sys
-from datetime import date
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
 from pathlib import Path
+from types import ModuleType
 
 import pytest
 
@@ -11,17 +18,37 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-from app import auth, data, security, services
+from app import auth, data, security, services, web
 from app.exceptions import AppError
-from app.models import AuditAction, Exam, ExamStatus, Role
+from app.models import AuditAction, AuditLogEntry, Exam, ExamStatus, Role
+
+
+def _module_state(module: ModuleType) -> dict:
+    return {
+        name: value
+        for name, value in vars(module).items()
+        if not name.startswith("__") and not callable(value) and not isinstance(value, ModuleType)
+    }
+
+
+@pytest.fixture(scope="session")
+def initial_data_state():
+    # 一次深拷贝整个数据模块的状态，共享的对象（各索引中的同一条成绩）在拷贝中仍保持共享
+    return copy.deepcopy(_module_state(data))
 
 
 @pytest.fixture()
-def fresh_app_state():
-    importlib.reload(security)
-    importlib.reload(data)
-    importlib.reload(services)
-    importlib.reload(auth)
+def fresh_app_state(initial_data_state):
+    for name, value in copy.deepcopy(initial_data_state).items():
+        setattr(data, name, value)
+    auth._tokens.clear()
+    auth._tokens_by_user.clear()
+    security._verify_cache.clear()
+    services._overview_cache.clear()
+    web.SESSIONS = web.SessionStore()
+    for value in vars(web).values():
+        if hasattr(value, "cache_clear"):
+            value.cache_clear()
 
 
 def _login(username: str, password: str = "Pass@123"):
@@ -32,6 +59,23 @@ def _account(token: str):
     return auth.get_account(token)
 
 
+def _page_text(parts) -> str:
+    return "".join(part.decode("utf-8") if isinstance(part, bytes) else part for part in parts)
+
+
+@contextmanager
+def _running_server():
+    server = web.ThreadingHTTPServer(("127.0.0.1", 0), web.GradeRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
 def test_student_login_and_access_control(fresh_app_state):
     login = _login("s_s001")
     assert login.role == Role.STUDENT
@@ -94,6 +138,74 @@ def test_principal_reset_password_and_overview(fresh_app_state):
     assert any(entry.subject_code == "MTH" for entry in overview)
 
 
+def test_revoke_tokens_keeps_only_the_current_session(fresh_app_state):
+    stale_token = _login("s_s002").token
+    auth.reset_password("s_s002")
+    assert _account(stale_token).username == "s_s002"
+    auth.revoke_tokens("s_s002")
+    with pytest.raises(AppError):
+        _account(stale_token)
+
+    current_token = _login("principal").token
+    other_token = _login("principal").token
+    auth.revoke_tokens("principal", keep=current_token)
+    assert _account(current_token).username == "principal"
+    with pytest.raises(AppError):
+        _account(other_token)
+
+
+def test_statistics_keep_integer_scores(fresh_app_state):
+    overview = {entry.subject_code: entry.stats for entry in services.principal_overview("EX2025M")}
+    assert repr(overview["MTH"].highest) == "95"
+    assert repr(overview["MTH"].lowest) == "73"
+    assert repr(services._aggregate_scores([80, 90]).average) == "85"
+
+    student = _account(_login("s_s001").token)
+    views = services.list_student_grades(student, exam_id="EX2025M").grades
+    assert repr(next(view for view in views if view.subject_code == "MTH").class_average) == "85"
+
+
+def test_in_place_catalog_edits_refresh_cached_views(fresh_app_state):
+    principal_session = web.SessionData(token=auth.authenticate("principal", "Pass@123").token)
+    _page_text(web.render_principal_page(principal_session))
+    assert any(entry.subject_name == "数学" for entry in services.principal_overview())
+
+    data.subjects["MTH"].subject_name = "高等数学"
+    data.students["S001"].class_name = "Class 9"
+    page = _page_text(web.render_principal_page(principal_session))
+    assert '<option value="MTH">高等数学</option>' in page
+    assert '<option value="Class 9">Class 9</option>' in page
+    assert any(entry.subject_name == "高等数学" for entry in services.principal_overview())
+
+
+def test_cached_overview_entries_are_immutable(fresh_app_state):
+    entry = services.principal_overview()[0]
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        entry.stats.highest = 0
+    assert services.principal_overview()[0].stats == entry.stats
+
+
+def test_audit_indexes_follow_main_log_eviction(fresh_app_state, monkeypatch):
+    monkeypatch.setattr(data, "AUDIT_LOG_LIMIT", 3)
+    data.flush_audit_logs()
+    entries = [
+        AuditLogEntry(
+            timestamp=datetime.now(timezone.utc),
+            actor="T200",
+            action=AuditAction.GRADE_UPDATED,
+            details={"subject_code": "MTH", "n": n},
+        )
+        for n in range(5)
+    ]
+    data.add_audit_logs(entries)
+    data.flush_audit_logs()
+
+    assert list(data.audit_logs) == entries[2:]
+    assert list(data.audit_by_actor["T200"]) == entries[2:]
+    assert list(data.audit_by_subject["MTH"]) == entries[2:]
+    assert sum(map(len, data.audit_by_actor.values())) == 3
+
+
 def test_login_lockout_policy(fresh_app_state):
     for _ in range(5):
         with pytest.raises(AppError) as exc:
@@ -116,16 +228,181 @@ def test_teacher_exports_are_logged(fresh_app_state):
 
 
 def test_web_login_and_student_dashboard(fresh_app_state):
-    from app import web
-
-    importlib.reload(web)
-
     session = web.SessionData()
-    login_html = web.render_login_page(session)
+    login_html = _page_text(web.render_login_page(session))
     assert "登录" in login_html
 
     login = auth.authenticate("s_s001", "Pass@123")
     session.token = login.token
 
-    student_page = web.render_student_page(session)
+    student_page = _page_text(web.render_student_page(session))
     assert "我的成绩" in student_page
+
+
+def test_class_average_tracks_grade_updates(fresh_app_state):
+    student_account = _account(_login("s_s001").token)
+    before = services.list_student_grades(student_account, exam_id="EX2025M")
+    assert {item.subject_code: item.class_average for item in before.grades}["MTH"] == 85.0
+
+    teacher_account = _account(_login("t_mth").token)
+    services.teacher_update_grade(teacher_account, "EX2025M", "MTH", "S001", 65)
+
+    after = services.list_student_grades(student_account, exam_id="EX2025M")
+    assert {item.subject_code: item.class_average for item in after.grades}["MTH"] == 75.0
+
+
+def test_legacy_password_hash_is_upgraded_on_login(fresh_app_state):
+    salt = bytes(16)
+    legacy = f"{salt.hex()}${security._legacy_salt_password('Pass@123', salt).hex()}"
+    data.accounts["s_s004"].password_hash = legacy
+
+    _login("s_s004")
+    upgraded = data.accounts["s_s004"].password_hash
+    assert upgraded.startswith(f"{security.SCHEME}$")
+    assert security.verify_password("Pass@123", upgraded)
+
+
+def test_expired_token_is_rejected(fresh_app_state):
+    login = _login("s_s001")
+    key = auth._token_key(login.token)
+    username, issued_at = auth._tokens[key]
+    auth._tokens[key] = (username, issued_at - auth.TOKEN_TTL)
+
+    with pytest.raises(AppError) as exc:
+        _account(login.token)
+    assert exc.value.status_code == 401
+    assert key not in auth._tokens
+
+
+def test_principal_overview_reflects_score_updates(fresh_app_state):
+    teacher_account = _account(_login("t_mth").token)
+    before = next(entry.stats for entry in services.principal_overview("EX2025M") if entry.subject_code == "MTH")
+    assert before.lowest > 40
+    services.teacher_update_grade(teacher_account, "EX2025M", "MTH", "S005", 40)
+
+    stats = next(entry.stats for entry in services.principal_overview("EX2025M") if entry.subject_code == "MTH")
+    assert stats.lowest == 40
+    assert stats.pass_rate == 83.33
+
+
+def test_teacher_audit_logs_are_scoped_to_subjects(fresh_app_state):
+    math_teacher = _account(_login("t_mth").token)
+    chinese_teacher = _account(_login("t_chn").token)
+    services.teacher_update_grade(math_teacher, "EX2025M", "MTH", "S002", 88)
+    services.teacher_export_grades(chinese_teacher)
+
+    math_logs = services.list_audit_logs(math_teacher)
+    assert [log.action for log in math_logs] == [AuditAction.GRADE_UPDATED]
+
+    chinese_logs = services.list_audit_logs(chinese_teacher)
+    assert [log.action for log in chinese_logs] == [AuditAction.EXPORT]
+
+    principal = _account(_login("principal").token)
+    assert len(services.list_audit_logs(principal)) == 2
+
+
+def test_web_teacher_and_principal_dashboards(fresh_app_state):
+    teacher_session = web.SessionData(token=auth.authenticate("t_mth", "Pass@123").token)
+    teacher_page = _page_text(web.render_teacher_page(teacher_session, exam_id="EX2025M"))
+    assert "科目成绩列表" in teacher_page
+
+    principal_session = web.SessionData(token=auth.authenticate("principal", "Pass@123").token)
+    principal_page = _page_text(web.render_principal_page(principal_session, class_name="Class 1"))
+    assert "校长总览" in principal_page
+
+
+def test_rejected_post_body_does_not_leak_into_next_request(fresh_app_state):
+    with _running_server() as (host, port):
+        conn = http.client.HTTPConnection(host, port, timeout=5)
+        try:
+            conn.request(
+                "POST",
+                "/principal/reset",
+                body="username=s_s001",
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+            )
+            response = conn.getresponse()
+            response.read()
+            assert response.status == 303
+            location = response.getheader("Location")
+            cookie = response.getheader("Set-Cookie").split(";", 1)[0]
+
+            conn.request("GET", location, headers={"Cookie": cookie})
+            response = conn.getresponse()
+            assert response.status == 200
+            assert "无权执行该操作" in response.read().decode("utf-8")
+
+            conn.request("GET", "/login")
+            response = conn.getresponse()
+            assert response.status == 200
+            response.read()
+        finally:
+            conn.close()
+
+
+def test_slow_client_does_not_block_other_requests(fresh_app_state):
+    with _running_server() as (host, port):
+        with socket.create_connection((host, port), timeout=5) as slow:
+            slow.sendall(b"POST /login HTTP/1.1\r\nHost: test\r\nContent-Length: 100\r\n\r\nusername=")
+            conn = http.client.HTTPConnection(host, port, timeout=5)
+            try:
+                conn.request("GET", "/login")
+                response = conn.getresponse()
+                assert response.status == 200
+                response.read()
+            finally:
+                conn.close()
+
+
+def test_expect_continue_is_sent_before_body(fresh_app_state):
+    with _running_server() as (host, port):
+        with socket.create_connection((host, port), timeout=5) as client:
+            body = b"username=s_s001&password=Pass@123"
+            client.sendall(
+                b"POST /login HTTP/1.1\r\nHost: test\r\nExpect: 100-continue\r\n"
+                b"Content-Type: application/x-www-form-urlencoded\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n"
+            )
+            assert client.recv(1024).startswith(b"HTTP/1.1 100 Continue")
+            client.sendall(body)
+            assert client.recv(1024).startswith(b"HTTP/1.1 303 See Other")
+
+
+def test_import_flashes_keep_summary_and_every_row_error(fresh_app_state):
+    rows = ["exam_id,subject_code,student_no,score", "EX2025M,MTH,S001,91"]
+    rows += [f"EX2025M,MTH,X{index:03d},90" for index in range(40)]
+    with _running_server() as (host, port):
+        conn = http.client.HTTPConnection(host, port, timeout=5)
+        form_headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        try:
+            conn.request("POST", "/login", body="username=t_mth&password=Pass%40123", headers=form_headers)
+            response = conn.getresponse()
+            response.read()
+            cookie = response.getheader("Set-Cookie").split(";", 1)[0]
+
+            body = urllib.parse.urlencode({"csv_text": "\n".join(rows)})
+            conn.request("POST", "/teacher/import", body=body, headers={**form_headers, "Cookie": cookie})
+            response = conn.getresponse()
+            response.read()
+            assert response.status == 303
+
+            conn.request("GET", "/teacher", headers={"Cookie": cookie})
+            page = conn.getresponse().read().decode("utf-8")
+        finally:
+            conn.close()
+    assert "成功导入 1 条成绩记录" in page
+    assert all(f"第 {line} 行导入失败" in page for line in range(3, 43))
+
+
+@pytest.mark.parametrize(
+    ("content_length", "status"),
+    [("abc", 400), ("-1", 400), (str(web.MAX_FORM_BYTES + 1), 413)],
+)
+def test_invalid_or_oversized_form_is_rejected(fresh_app_state, content_length, status):
+    with _running_server() as (host, port):
+        with socket.create_connection((host, port), timeout=5) as client:
+            client.sendall(
+                b"POST /no-such-path HTTP/1.1\r\nHost: test\r\n"
+                b"Content-Length: " + content_length.encode() + b"\r\n\r\n"
+            )
+            assert client.recv(1024).startswith(f"HTTP/1.1 {status} ".encode())